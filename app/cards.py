@@ -0,0 +1,129 @@
+from bs4 import BeautifulSoup as BS
+from bs4 import SoupStrainer
+from collections import namedtuple
+
+try:
+    import lxml  # noqa: F401
+    FEATURES = 'lxml'
+except ImportError:
+    FEATURES = 'html.parser'
+
+MATCH_CLASS = 'imspo_mt__mtc-no'
+
+MatchCard = namedtuple('MatchCard', [
+    'hteam', 'hteamgoals', 'ateam', 'ateamgoals', 'match_type', 'when', 'status', 'hred', 'ared', 'hwin', 'awin'
+])
+
+# field: (path of .contents indexes from the card, kind, required)
+FIELDS = {
+    'hteam': ([4, 1, 1, 0], 'text', True),
+    'hteamgoals': ([4, 1, 0], 'goals', True),
+    'ateam': ([5, 1, 1, 0], 'text', True),
+    'ateamgoals': ([5, 1, 0], 'goals', True),
+    'match_type': ([1, 0, 0, 2], 'text', True),
+    'when': ([2, 2, 0, 0, 0], 'when', False),
+    'status': ([2, 2, 0], 'lower', False),
+    'hred': ([4, 1, 1, 0, 2, 0], 'shown', False),
+    'ared': ([5, 1, 1, 0, 2, 0], 'shown', False),
+    'hwin': ([4, 2, 0], 'shown', False),
+    'awin': ([5, 2, 0], 'shown', False)
+}
+
+
+class LayoutError(Exception):
+    '''
+    the match cards do not look like they used to, google has probably changed the page
+    '''
+
+
+def goalfixer(goal):
+    '''
+    checks that there is a number present or returns 0
+    '''
+    if '(' in goal:
+        rg = goal.replace(' ', '').replace(')', '')
+        goal = rg.split('(')
+        try:
+            goal = (int(goal[0]), int(goal[1]))
+        except Exception:
+            goal = (0, 0)
+    else:
+        try:
+            goal = (int(goal[0]), None)
+        except Exception:
+            goal = (0, None)
+    return goal
+
+
+def _when(node):
+    contents = node.contents
+    return contents[0].text, contents[1].text
+
+
+CONVERTERS = {
+    'text': lambda node: node.text,
+    'lower': lambda node: node.text.lower(),
+    'goals': lambda node: goalfixer(node.text),
+    'shown': lambda node: node.get('style') != 'display:none',
+    'when': _when
+}
+
+
+class Extractor:
+    '''
+    all the paths in fields are compiled into one tree of indexes,
+    so every card is walked once and paths sharing a beginning share the walk
+    '''
+    def __init__(self, fields=FIELDS):
+        self.fields = fields
+        self.tree = ([], {})  # (fields ending here, children by index)
+        for name, (path, kind, required) in fields.items():
+            node = self.tree
+            for i in path:
+                node = node[1].setdefault(i, ([], {}))
+            node[0].append((name, CONVERTERS[kind]))
+
+    def _walk(self, node, tree, values):
+        for name, convert in tree[0]:
+            try:
+                values[name] = convert(node)
+            except Exception:
+                values[name] = None
+        for i, subtree in tree[1].items():
+            try:
+                child = node.contents[i]
+            except (AttributeError, IndexError):
+                continue
+            self._walk(child, subtree, values)
+
+    def extract(self, card):
+        '''
+        one MatchCard from the first child of a match card div, LayoutError if a required field is missing
+        '''
+        values = dict.fromkeys(self.fields)
+        self._walk(card, self.tree, values)
+        for name, (path, kind, required) in self.fields.items():
+            if required and values[name] is None:
+                raise LayoutError(f'match card layout has changed, {name} is not at {path} any more')
+            if kind == 'lower' and values[name] is None:
+                values[name] = ''
+        return MatchCard(**values)
+
+
+EXTRACTOR = Extractor()
+
+
+def parse_matches(body, features=FEATURES, strain=True):
+    '''
+    turns a results page into one MatchCard per match card on it
+    with strain only the match cards are built into the tree, the rest of the page is skipped
+    nothing in the result refers back to the soup, so this can be run in a thread or process pool
+    '''
+    parse_only = SoupStrainer('div', class_=MATCH_CLASS) if strain else None
+    page = BS(body, features, parse_only=parse_only)
+    matches = []
+    for match in page.find_all('div', class_=MATCH_CLASS):
+        if not match.contents:
+            raise LayoutError('match card is empty, google has probably changed the page')
+        matches.append(EXTRACTOR.extract(match.contents[0]))
+    return matches
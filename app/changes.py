@@ -0,0 +1,104 @@
+from hashlib import blake2b
+import json
+import re
+
+DIV = re.compile(rb'<div\b|</div\s*>', re.IGNORECASE)
+
+
+def digest(data):
+    return blake2b(data, digest_size=16).digest()
+
+
+def fragments(body, marker):
+    '''
+    yields the divs of a raw page that have marker in their opening tag, without parsing anything
+    a div ends at its matching </div> (found by counting divs), so nothing around the cards is included
+    a div that is never closed runs to the end of the page
+    '''
+    start = body.find(marker)
+    while start != -1:
+        begin = body.rfind(b'<div', 0, start)
+        if begin == -1 or b'>' in body[begin:start]:  # marker is somewhere else (a stylesheet, a script), not in a div's tag
+            start = body.find(marker, start + len(marker))
+            continue
+        end = len(body)
+        depth = 0
+        for tag in DIV.finditer(body, begin):
+            depth += -1 if tag.group(0).startswith(b'</') else 1
+            if depth == 0:
+                end = tag.end()
+                break
+        yield body[begin:end]
+        start = body.find(marker, end)
+
+
+class ChangeDetector:
+    '''
+    remembers a fingerprint per key (usually the url) so that a poll returning the same thing
+    as the last one can be thrown away before any parsing, diffing or logging is done
+    also keeps ETag/Last-Modified per url for conditional requests
+    new fingerprints and validators are only pending until commit (see Poller.poll), so a poll that fails or is cancelled
+    after fetching does not get the same payload skipped from then on
+    '''
+    def __init__(self):
+        self.fingerprints = {}
+        self.validators = {}
+        self.pending = {}, {}  # fingerprints, validators
+
+    def changed(self, key, fingerprint):
+        '''
+        tells if fingerprint differs from the last committed one, and keeps it until commit if so
+        '''
+        if self.fingerprints.get(key) == fingerprint:
+            return False
+        self.pending[0][key] = fingerprint
+        return True
+
+    def commit(self):
+        '''
+        the payloads seen since the last commit have been dealt with
+        '''
+        fingerprints, validators = self.pending
+        self.fingerprints.update(fingerprints)
+        self.validators.update(validators)
+        self.rollback()
+
+    def rollback(self):
+        self.pending = {}, {}
+
+    def html(self, key, body, marker):
+        '''
+        fingerprints only the match card parts of a page, so ads and tokens elsewhere do not count as changes
+        '''
+        h = blake2b(digest_size=16)
+        for fragment in fragments(body, marker):
+            h.update(fragment)
+        return self.changed(key, h.digest())
+
+    def json(self, key, body):
+        '''
+        returns the parsed body, or None if it is the same as last time
+        identical bytes are caught without parsing, reordered keys and whitespace after parsing
+        '''
+        if not self.changed((key, 'raw'), digest(body)):
+            return None
+        data = json.loads(body)
+        normalized = json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+        if not self.changed(key, digest(normalized)):
+            return None
+        return data
+
+    def conditional_headers(self, url, headers=None):
+        '''
+        adds If-None-Match/If-Modified-Since to headers if the server has given us validators before
+        '''
+        headers = dict(headers or {})
+        etag, modified = self.validators.get(url, (None, None))
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+        return headers
+
+    def remember(self, url, headers):
+        self.pending[1][url] = (headers.get('ETag'), headers.get('Last-Modified'))
@@ -0,0 +1,80 @@
+from app.lanes import slack_lane, upstream_lane
+from app.metrics import Metrics
+from app.slack import SlackDispatcher
+import asyncio
+import logging
+
+
+class Competitions:
+    '''
+    one reporter per competition (a google query or a football-data.org competition id, see follow in google.py and fd.py),
+    each with its own matches, scheduler and poller, so every competition is polled as often as its own matches need
+    all of them share one upstream lane (see app.lanes), which is the budget for requests in flight across every competition,
+    and one slack dispatcher (with its lane), the metrics (see Metrics.child) and the log files, all made here and handed to the reporters
+    looks enough like a reporter to be used by sportsball.py, app.daemon and app.metrics
+    '''
+    def __init__(self, module, competitions, concurrency=10):
+        self.session, self.sem = upstream_lane(concurrency)
+        self.slack_session, slack_sem = slack_lane()
+        self.logger = logging.getLogger(__file__)
+        self.logger.setLevel(logging.INFO)
+        self.dispatcher = SlackDispatcher(self.slack_session, slack_sem, self.logger)
+        self.metrics = Metrics()
+        self.dispatcher.metrics = self.metrics
+        sinks = {}
+        self.reporters = []
+        for competition in competitions:
+            reporter = module.WorldCupSlackReporter(self.session, self.sem, self.dispatcher, self.metrics.child(), sinks)
+            reporter.follow(competition)
+            self.reporters.append(reporter)
+        self.poller = self.reporters[0].poller
+        self.project_path = self.reporters[0].project_path
+        self.store = None
+        self.sleep = 0
+
+    @property
+    def stream(self):
+        return self.reporters[0].stream
+
+    @stream.setter
+    def stream(self, stream):
+        '''
+        events are found by each competition's own poller, see app.poller
+        '''
+        for reporter in self.reporters:
+            reporter.stream = stream
+
+    @property
+    def matches(self):
+        return {f'{i}:{match_id}': state for i, reporter in enumerate(self.reporters) for match_id, state in reporter.matches.items()}
+
+    @matches.setter
+    def matches(self, matches):
+        '''
+        only for starting over (see app.daemon), the matches belong to the reporters
+        '''
+        for reporter in self.reporters:
+            reporter.matches = {}
+
+    async def get_fixtures(self):
+        '''
+        every kickoff of every competition, None if none of them has a schedule
+        '''
+        fixtures = [kickoffs for kickoffs in await asyncio.gather(*(r.get_fixtures() for r in self.reporters)) if kickoffs is not None]
+        if not fixtures:
+            return None
+        return [kickoff for kickoffs in fixtures for kickoff in kickoffs]
+
+    async def get_todays_matches(self):
+        await asyncio.gather(*(reporter.get_todays_matches() for reporter in self.reporters))
+
+    async def monitor(self):
+        await asyncio.gather(*(reporter.monitor() for reporter in self.reporters))
+
+    async def _slack_output(self, message, seen=None):
+        await self.reporters[0]._slack_output(message, seen)
+
+    async def close(self):
+        for reporter in self.reporters:
+            await reporter.close()
+        await self.slack_session.close()
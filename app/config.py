@@ -0,0 +1,151 @@
+'''
+settings files are read, checked and turned into one Config once at startup, instead of every reporter picking at the json
+'''
+from collections import namedtuple
+from datetime import datetime
+from types import MappingProxyType
+import glob
+import json
+import os
+
+PROVIDERS = ('google', 'fd', 'wc')
+DEFAULTS = {
+    'slack_instances': (),
+    'slack_payload': {},
+    'provider': 'google',
+    'providers': (),
+    'team_aliases': {},
+    'competitions': (),
+    'max_requests': 10,
+    'football_data_token': None,
+    'hours_to_add': 0,
+    'poll_jitter': 0.1,
+    'parse_workers': None,
+    'hedge_hosts': (),
+    'fetch_deadline': 10,
+    'metrics_port': None,
+    'stream_port': None,
+    'announce_at': '07:00',
+    'state': None,
+    'journal': None,
+    'digest': False,
+    'capture': None,
+    'today_url': None,
+    'fixtures_url': None
+}
+Config = namedtuple('Config', DEFAULTS)
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def read(paths):
+    '''
+    the settings files in paths as a list of dicts, a directory means every .json file in it
+    '''
+    files = []
+    for path in paths:
+        files.extend(sorted(glob.glob(os.path.join(path, '*.json'))) if os.path.isdir(path) else [path])
+    if not files:
+        raise ConfigError(f'no settings files in {", ".join(paths)}')
+    tenants = []
+    for file in files:
+        with open(file, 'r') as settings_file:
+            try:
+                tenants.append(json.load(settings_file))
+            except ValueError as e:
+                raise ConfigError(f'{file}: {e}')
+        if not isinstance(tenants[-1], dict):
+            raise ConfigError(f'{file}: the settings are not a json object')
+    return tenants
+
+
+def check(name, ok, value):
+    if not ok:
+        raise ConfigError(f'{name}: {value!r} is not a valid value')
+
+
+def number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def text(value):
+    return value is None or isinstance(value, str)
+
+
+def mapping(value, values=str):
+    return value is None or isinstance(value, dict) and all(isinstance(k, str) and isinstance(v, values) for k, v in value.items())
+
+
+def freeze(value):
+    '''
+    value with its dicts turned into read-only mappings and its lists into tuples, so a Config can not be changed through it
+    '''
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def check_tenant(tenant):
+    '''
+    what is taken from every settings file, not just the first: its slack instances and their slack_payload
+    '''
+    check('slack_instances', isinstance(tenant.get('slack_instances') or [], list), tenant.get('slack_instances'))
+    check('slack_payload', mapping(tenant.get('slack_payload') or None, object), tenant.get('slack_payload'))
+    for si in tenant.get('slack_instances') or ():
+        check('slack_instances', isinstance(si, dict) and isinstance(si.get('webhook'), str) and si.get('webhook'), si)
+        check('channel', text(si.get('channel')), si.get('channel'))
+        check('participants', mapping(si.get('participants')), si.get('participants'))
+
+
+def load(paths, provider=None):
+    '''
+    one Config from the settings files in paths
+    the first file decides everything, except that the slack instances of all of them are posted to,
+    each with the slack_payload of its own file
+    provider, if given, is used instead of the one in the settings (see --provider in sportsball.py)
+    every setting is checked (a ConfigError says what is wrong), and the Config holds no dicts or lists, see freeze
+    '''
+    tenants = read(paths)
+    for tenant in tenants:
+        check_tenant(tenant)
+    settings = dict(DEFAULTS)
+    settings.update((key.replace('-', '_'), value) for key, value in tenants[0].items() if key.replace('-', '_') in DEFAULTS)
+    if provider is not None:
+        settings['provider'] = provider
+    settings['slack_instances'] = tuple(
+        dict(si, slack_payload=tenant.get('slack_payload')) for tenant in tenants for si in tenant.get('slack_instances') or ()
+    )
+    settings['hours_to_add'] = settings['hours_to_add'] or 0
+    settings['slack_payload'] = settings['slack_payload'] or {}
+    settings['team_aliases'] = settings['team_aliases'] or {}
+    check('provider', settings['provider'] in PROVIDERS, settings['provider'])
+    for name, ok in (('providers', lambda item: item in PROVIDERS),
+                     ('competitions', lambda item: isinstance(item, str) or number(item) and isinstance(item, int)),
+                     ('hedge_hosts', lambda item: isinstance(item, str))):
+        check(name, isinstance(settings[name] or (), (list, tuple)) and all(ok(item) for item in settings[name] or ()), settings[name])
+        settings[name] = tuple(settings[name] or ())
+    check('team_aliases', mapping(settings['team_aliases']), settings['team_aliases'])
+    for name in ('football_data_token', 'state', 'journal', 'capture', 'today_url', 'fixtures_url'):
+        check(name, text(settings[name]), settings[name])
+    check('digest', isinstance(settings['digest'], bool), settings['digest'])
+    check('hours_to_add', number(settings['hours_to_add']), settings['hours_to_add'])
+    for name in ('metrics_port', 'stream_port'):
+        check(name, settings[name] is None or number(settings[name]) and isinstance(settings[name], int), settings[name])
+    check('poll_jitter', number(settings['poll_jitter']) and 0 <= settings['poll_jitter'] < 1, settings['poll_jitter'])
+    check('parse_workers', settings['parse_workers'] in (None, 'process', 'thread'), settings['parse_workers'])
+    check('max_requests', number(settings['max_requests']) and isinstance(settings['max_requests'], int) and settings['max_requests'] > 0, settings['max_requests'])
+    check('fetch_deadline', number(settings['fetch_deadline']) and settings['fetch_deadline'] > 0, settings['fetch_deadline'])
+    if settings['competitions']:  # every competition is a reporter of its own, see app/competitions.py
+        if settings['provider'] == 'wc':
+            raise ConfigError('competitions need provider google or fd, wc only has the world cup')
+        if settings['providers'] or settings['state']:
+            raise ConfigError('competitions cannot be combined with providers or state')
+    try:
+        datetime.strptime(settings['announce_at'], '%H:%M')
+    except (TypeError, ValueError):
+        check('announce_at', False, settings['announce_at'])
+    return Config(**{name: freeze(value) for name, value in settings.items()})
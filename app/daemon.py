@@ -0,0 +1,89 @@
+from app.fixtures import FixtureCalendar
+from datetime import date, datetime, timedelta
+import asyncio
+import time
+
+
+class Daemon:
+    '''
+    keeps one reporter (and with it one session and one set of settings) running for a whole tournament,
+    instead of starting a new one from cron every day
+    * the schedule is loaded once, from reporter.get_fixtures, into a FixtureCalendar
+    * on every day with matches it wakes at announce (HH:MM, local time) and posts today's matches
+    * then it sleeps until self.lead seconds before the first kickoff, and monitors until all of the day's matches are done
+    * it stops after the last match day of the calendar
+    * if the reporter has a store (see app.store) with today's matches in it, they are picked up instead of announced again
+    * if today's matches cannot be got while the calendar has kickoffs today, it tries again, backing off from backoff
+      to max_backoff seconds, until 2h after the last kickoff
+    * with a journal (see app.journal), events already posted today are not posted again, and with digest,
+      a recap of the day is posted once all of its matches are done
+    without a schedule (get_fixtures returning None) every day is a match day, and it runs until stopped
+    '''
+    def __init__(self, announce='07:00', lead=600, journal=None, digest=False, backoff=30, max_backoff=900):
+        self.announce = datetime.strptime(announce, '%H:%M').time()
+        self.lead = lead
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.journal = journal
+        self.digest = digest
+        self.calendar = None
+
+    async def load(self, reporter):
+        kickoffs = await reporter.get_fixtures()
+        self.calendar = FixtureCalendar(kickoffs) if kickoffs is not None else None
+        if self.calendar is not None:
+            reporter.logger.info(f'{len(self.calendar)} matches on {len(self.calendar.dates)} days in the calendar')
+
+    def wake_at(self, day):
+        return datetime.combine(day, self.announce).timestamp()
+
+    def next_day(self, day):
+        if self.calendar is None:
+            return day
+        return self.calendar.next_day(day)
+
+    def first_kickoff(self, reporter, day):
+        '''
+        earliest kickoff of the matches not yet started, from the reporter if it knows, else from the calendar
+        '''
+        kickoffs = [m.kickoff for m in reporter.matches.values() if m.status == 0 and m.kickoff is not None]
+        if not kickoffs and self.calendar is not None:
+            kickoffs = self.calendar.kickoffs(day)
+        return min(kickoffs, default=None)
+
+    async def get_todays_matches(self, reporter, day):
+        '''
+        today's matches, asked for again (see above) until there are some if the calendar says there should be
+        '''
+        delay = self.backoff
+        while True:
+            await reporter.get_todays_matches()
+            kickoffs = self.calendar.kickoffs(day) if self.calendar is not None else []
+            if reporter.matches or not kickoffs:
+                return
+            if time.time() + delay > max(kickoffs) + 9000:
+                reporter.logger.error(f'gave up on getting the {len(kickoffs)} matches of {day.isoformat()}')
+                return
+            reporter.logger.warning(f'no matches found for {day.isoformat()}, the calendar has {len(kickoffs)}, trying again in {delay} seconds')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
+
+    async def run(self, reporter):
+        await self.load(reporter)
+        day = self.next_day(date.today())
+        while day is not None:
+            await asyncio.sleep(max(self.wake_at(day) - time.time(), 0))
+            reporter.matches = reporter.store.load() if reporter.store is not None else {}
+            if not reporter.matches:
+                await self.get_todays_matches(reporter, day)
+                if self.journal is not None:
+                    await self.journal.replay(reporter.matches, day)
+                if reporter.store is not None:
+                    await reporter.store.save(reporter.matches)
+            kickoff = self.first_kickoff(reporter, day)
+            if kickoff is not None:
+                await asyncio.sleep(max(kickoff - self.lead - time.time(), 0))
+            await reporter.monitor()
+            if self.digest and self.journal is not None:
+                await reporter._slack_output(await self.journal.digest(day))
+            day = self.next_day(max(day + timedelta(days=1), date.today()))
@@ -0,0 +1,50 @@
+'''
+what the reporters find, as plain events: start, goal, red_card, half_time and end of a match
+they are worked out by comparing a match's MatchState (see app.state) before and after a poll, so they look the same whichever provider found them
+'''
+import time
+
+FIELDS = ('status', 'hgoals', 'agoals', 'half_time', 'hred', 'ared')
+
+
+def snapshot(state):
+    return tuple(getattr(state, name) for name in FIELDS)
+
+
+def happened(before, state):
+    '''
+    (type, side) of everything that happened to state since snapshot before, side is home, away or None
+    '''
+    status, hgoals, agoals, half_time, hred, ared = before
+    found = []
+    if state.status >= 1 and status == 0:
+        found.append(('start', None))
+    if state.hred and not hred:
+        found.append(('red_card', 'home'))
+    if state.ared and not ared:
+        found.append(('red_card', 'away'))
+    if state.hgoals + state.agoals > hgoals + agoals:
+        found.append(('goal', 'home' if state.hgoals > hgoals else 'away'))
+    if state.half_time and not half_time:
+        found.append(('half_time', None))
+    if state.status == 2 and status != 2:
+        found.append(('end', None))
+    return found
+
+
+def event(kind, side, state, seen=None):
+    return {
+        'type': kind, 'side': side, 'match': state.match_id, 'home': state.hteam, 'away': state.ateam,
+        'hgoals': state.hgoals, 'agoals': state.agoals, 'time': seen or time.time()
+    }
+
+
+def changes(before, matches, seen=None):
+    '''
+    events for every match in matches that changed since before, a dict of snapshots by match_id
+    '''
+    return [
+        event(kind, side, state, seen)
+        for match_id, state in matches.items() if match_id in before
+        for kind, side in happened(before[match_id], state)
+    ]
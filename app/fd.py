@@ -1,5 +1,14 @@
+from app.changes import ChangeDetector
+from app.fixtures import FixtureCache
+from app.lanes import slack_lane, upstream_lane
+from app.logsink import shared_sink
+from app.metrics import Metrics
+from app.poller import Poller
+from app.schedule import PollScheduler
+from app.slack import SlackDispatcher
+from app.state import MatchState
 from dateutil import parser
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import aiohttp
 import asyncio
 import json
@@ -9,22 +18,42 @@ import time
 
 
 class WorldCupSlackReporter:
-    def __init__(self):
+    def __init__(self, session=None, sem=None, dispatcher=None, metrics=None, sinks=None):
+        '''
+        session and sem (the upstream lane), dispatcher, metrics and sinks (log sinks by path, see app.logsink)
+        are given when they are shared with other reporters (see app.race and app.competitions), else they are made here
+        '''
         self.today_url = 'http://worldcup.sfg.io/matches/today'
         self.fixtures_url = 'http://api.football-data.org/v1/competitions/467/fixtures'
         self.headers = None
-
-        self.sem = asyncio.Semaphore(5)
-        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False))
+        self.cache = FixtureCache()
+        self.matchdays = []  # of today's matches, polling only asks for these
+
+        self.changes = ChangeDetector()
+        self.recorder = None
+        self.store = None
+        self.stream = None
+        self.session, self.sem = upstream_lane() if session is None else (session, sem)
         self.logger = logging.getLogger(__file__)
         self.logger.setLevel(logging.INFO)
         logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+        self.metrics = Metrics() if metrics is None else metrics
+        self.slack_session = None  # only when the dispatcher is made here, a shared one is closed by whoever made it
+        if dispatcher is None:
+            self.slack_session, slack_sem = slack_lane()
+            dispatcher = SlackDispatcher(self.slack_session, slack_sem, self.logger)
+            dispatcher.metrics = self.metrics
+        self.dispatcher = dispatcher
         self.project_path = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+        self.request_log = shared_sink(os.path.join(self.project_path, 'logs', 'match-requests.log'), sinks)
         self.slack_instances = []
         self.slack_payload = None
-        self.update_rate = 90
+        self.scheduler = PollScheduler()
+        self.poller = Poller()
+        self.timeout = aiohttp.ClientTimeout(total=20)
 
         self.matches = {}
+        self.sleep = 0  # nothing to wait for before monitoring, the scheduler sleeps until the first kickoff
         self.event_types = {
             'goal-own': '[country]: Oh no, [player] just scored a goal on the wrong side of the field!',
             'yellow-card': '[country]: [player] just received a yellow card',
@@ -33,105 +62,191 @@ class WorldCupSlackReporter:
             'goal-penalty': '[country]: [player] gets a goal penalty'
         }
 
-    async def api_get(self, url):
-        async def _get(url):
+    async def api_get(self, url, changes_only=False):
+        '''
+        with changes_only, a conditional request is made and None is returned
+        if the response is the same as the last time (no parsing or logging is done then)
+        '''
+        async def _get(url, headers):
             try:
-                async with self.sem, self.session.get(url, headers=self.headers) as response:
-                    return await response.read(), response.status
-            except aiohttp.client_exceptions.ClientConnectorError as e:
+                async with self.sem, self.session.get(url, headers=headers, timeout=self.timeout) as response:
+                    return await response.read(), response.status, response.headers
+            except (aiohttp.client_exceptions.ClientConnectorError, asyncio.TimeoutError) as e:
                 self.logger.error(e)
-                return e, 999
-        response = await _get(url)
+                return e, 999, {}
+        headers = self.changes.conditional_headers(url, self.headers) if changes_only else self.headers
+        started = time.perf_counter()
+        response = await _get(url, headers)
+        self.metrics.fetch_seconds.observe(time.perf_counter() - started)
+        self.metrics.fetch_responses.inc(status=response[1])
+        if self.recorder is not None:
+            self.recorder.add(url, response[1], response[0])
+        if changes_only and response[1] == 304:
+            return
         if response[1] != 200:
             raise ConnectionError(f'did not get a 200 response: {response[0]}')
-        with open(os.path.join(self.project_path, 'logs', 'match-requests.log'), 'a+') as logfile:
-            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            data = json.dumps(json.loads(response[0]))
-            logfile.write(f'{now}: {data}\n')
-        return json.loads(response[0])
+        if changes_only:
+            self.changes.remember(url, response[2])
+            started = time.perf_counter()
+            data = self.changes.json(url, response[0])
+            if data is None:
+                return
+        else:
+            started = time.perf_counter()
+            data = json.loads(response[0])
+        self.metrics.parse_seconds.observe(time.perf_counter() - started)
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.request_log.write(f'{now}: '.encode() + response[0] + b'\n')
+        return data
+
+    def apply(self, config):
+        '''
+        takes its settings from config (see app.config)
+        '''
+        self.slack_instances = list(config.slack_instances)
+        self.slack_payload = config.slack_payload
+        self.scheduler.jitter = config.poll_jitter
+        self.headers = {'X-Auth-Token': config.football_data_token} if config.football_data_token else None
+
+    def follow(self, competition):
+        '''
+        report on another football-data.org competition (by id) than the world cup
+        '''
+        self.fixtures_url = f'http://api.football-data.org/v1/competitions/{competition}/fixtures'
+        self.cache = FixtureCache()
+
+    async def schedule(self):
+        '''
+        the fixtures of the whole competition from self.cache, which is only fetched again once it is older than its ttl
+        raises ConnectionError if it has to be fetched and that fails
+        '''
+        if self.cache.stale():
+            matches = await self.api_get(self.fixtures_url)
+            self.cache.fill((parser.parse(match.get('date')).timestamp(), match) for match in matches.get('fixtures'))
+        return self.cache
+
+    async def get_fixtures(self):
+        '''
+        kickoffs (epochs) of every match in the competition, for the daemon's calendar (see app.daemon)
+        '''
+        try:
+            cache = await self.schedule()
+        except ConnectionError as e:
+            self.logger.error(e)
+            return
+        return cache.kickoffs()
 
     async def get_todays_matches(self):
         try:
-            matches = await self.api_get(self.fixtures_url)
-            matches = matches.get('fixtures')
+            cache = await self.schedule()
         except ConnectionError as e:
             self.logger.error(e)
+            return
         message = 'Today\'s matches:\n'
-        for match in matches:
-            match_datetime = parser.parse(match.get('date'))
-            if match_datetime.date() != datetime.now().date():
-                continue
+        matchdays = set()
+        for kickoff, match in cache.on(date.today()):
             hteam = match.get('homeTeamName')
             ateam = match.get('awayTeamName')
-            start_time = (match_datetime + timedelta(hours=2)).strftime('%H:%M')
+            start_time = (datetime.utcfromtimestamp(kickoff) + timedelta(hours=2)).strftime('%H:%M')
             match_id = hteam + ateam
             if match_id not in self.matches:
-                self.matches[match_id] = {
-                    'score': '0 -0',
-                    'status': 0,
-                    'time': None,
-                    'half-time': False
-                }
+                self.matches[match_id] = MatchState(match_id, hteam, ateam, kickoff=kickoff)
+            matchdays.add(match.get('matchday'))
             message += f'{start_time}: {hteam} vs {ateam}\n'
-        asyncio.ensure_future(self._slack_output(message.rstrip()))
+        self.matchdays = sorted(matchday for matchday in matchdays if matchday is not None)
+        await self._slack_output(message.rstrip())
 
     async def get_current_matches(self):
+        '''
+        asks only for the matchdays of today's matches, and looks only at the matches being tracked
+        '''
+        urls = [f'{self.fixtures_url}?matchday={matchday}' for matchday in self.matchdays] or [self.fixtures_url]
+        for url in urls:
+            await self.check_matches(url)
+
+    async def check_matches(self, url):
         try:
-            matches = await self.api_get(self.fixtures_url)
-            matches = matches.get('fixtures')
+            matches = await self.api_get(url, changes_only=True)
         except ConnectionError as e:
             self.logger.error(e)
+            return
+        if matches is None:  # nothing changed upstream, but a match stuck in play still has to end some time
+            await self.check_timeouts(time.time())
+            return
+        seen = time.time()
+        matches = matches.get('fixtures')
         for match in matches:
-            match_datetime = parser.parse(match.get('date'))
-            if match_datetime.date() != datetime.now().date():
-                continue
             message = ''
             hteam = match.get('homeTeamName')
-            hteamgoals = match.get('result').get('goalsHomeTeam')
+            hteamgoals = match.get('result').get('goalsHomeTeam') or 0
 
             ateam = match.get('awayTeamName')
-            ateamgoals = match.get('result').get('goalsAwayTeam')
+            ateamgoals = match.get('result').get('goalsAwayTeam') or 0
 
             match_id = hteam + ateam
-            score = f'{hteamgoals} - {ateamgoals}'
+            state = self.matches.get(match_id)
+            if state is None:
+                continue
 
-            if match.get('status') == 'IN_PLAY' and self.matches.get(match_id).get('status') == 0:
+            if match.get('status') == 'IN_PLAY' and state.status == 0:
                 message += f'{hteam} vs {ateam} just started!\n'
-                self.matches[match_id]['status'] = 1
-                self.matches[match_id]['time'] = time.time()
+                self.metrics.events.inc(type='start')
+                state.status = 1
+                state.time = time.time()
 
-            if self.matches.get(match_id).get('status') == 2:
+            if state.status == 2:
                 continue
-            if score > self.matches.get(match_id).get('score'):
+            if hteamgoals + ateamgoals > state.goalcount:
                 message += f'GOOOOOAL! {hteam} {hteamgoals} - {ateamgoals} {ateam}\n'
-                self.matches[match_id]['score'] = score
+                self.metrics.events.inc(type='goal')
+                state.hgoals, state.agoals = hteamgoals, ateamgoals
 
             if match.get('status') == 'FINISHED':
                 message += f'Match ended! Final score:\n{hteam} {hteamgoals} - {ateamgoals} {ateam}\n'
-                self.matches[match_id]['status'] = 2
+                self.metrics.events.inc(type='end')
+                state.status = 2
 
-            if self.matches.get(match_id).get('status') == 1:
-                timediff = time.time() - self.matches.get(match_id).get('time')
+            if state.status == 1:
+                timediff = time.time() - state.time
                 if timediff > 9000:
                     message += f'Match (probably) ended (2h since start)! Final score:\n{hteam} {hteamgoals} - {ateamgoals} {ateam}\n'
-                    self.matches[match_id]['status'] = 2
-
-            asyncio.ensure_future(self._slack_output(message.rstrip()))
+                    self.metrics.events.inc(type='end')
+                    state.status = 2
+
+            await self._slack_output(message.rstrip(), seen)
+
+    async def check_timeouts(self, seen):
+        '''
+        ends the matches still in play 2h after they started, for polls that had nothing new to look at
+        '''
+        for state in self.matches.values():
+            if state.status == 1 and seen - state.time > 9000:
+                self.metrics.events.inc(type='end')
+                state.status = 2
+                await self._slack_output(
+                    f'Match (probably) ended (2h since start)! Final score:\n{state.hteam} {state.hgoals} - {state.agoals} {state.ateam}', seen
+                )
 
     async def monitor(self):
-        asyncio.ensure_future(self.get_current_matches())
-        await asyncio.sleep(self.update_rate)
-        asyncio.ensure_future(self.monitor())
-
-    async def _slack_output(self, message):
-        async def _send(url, output):
-            try:
-                async with self.sem, self.session.post(url, data=output) as response:
-                    return await response.read(), response.status
-            except aiohttp.client_exceptions.ClientConnectorError as e:
-                self.logger.error(e)
+        '''
+        polls until all of today's matches are done, see Poller
+        '''
+        await self.poller.run(self)
+
+    async def _slack_output(self, message, seen=None):
+        if not message:
+            return
         for si in self.slack_instances:
-            output = dict(self.slack_payload)
+            output = dict(si.get('slack_payload') or self.slack_payload)
             output['text'] = message
             output['channel'] = si.get('channel')
-            asyncio.ensure_future(_send(si.get('webhook'), json.dumps(output)))
+            self.dispatcher.put(si.get('webhook'), output, seen)
+
+    async def close(self):
+        await self.dispatcher.flush()
+        await self.session.close()
+        if self.slack_session is not None:
+            await self.slack_session.close()
+        await self.request_log.close()
+        if self.recorder is not None:
+            await self.recorder.close()
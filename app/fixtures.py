@@ -0,0 +1,73 @@
+from bisect import bisect_left, insort
+from datetime import date
+import time
+
+
+class FixtureCalendar:
+    '''
+    the kickoffs (epochs) of a whole tournament, indexed by the local date they are on
+    '''
+    def __init__(self, kickoffs=()):
+        self.days = {}
+        self.dates = []  # sorted, the keys of self.days
+        for kickoff in kickoffs:
+            self.add(kickoff)
+
+    def __len__(self):
+        return sum(len(kickoffs) for kickoffs in self.days.values())
+
+    def add(self, kickoff):
+        day = date.fromtimestamp(kickoff)
+        if day not in self.days:
+            self.days[day] = []
+            insort(self.dates, day)
+        if kickoff not in self.days[day]:
+            insort(self.days[day], kickoff)
+
+    def kickoffs(self, day):
+        '''
+        sorted kickoffs on day, empty if there are no matches then
+        '''
+        return self.days.get(day, [])
+
+    def next_day(self, day):
+        '''
+        the first date with matches on or after day, None once the tournament is over
+        '''
+        i = bisect_left(self.dates, day)
+        return self.dates[i] if i < len(self.dates) else None
+
+
+class FixtureCache:
+    '''
+    a competition's whole schedule, fetched once and then only again when it is older than ttl seconds
+    fixtures are kept as (kickoff epoch, fixture) by the local date of the kickoff, so every date is parsed once per fetch
+    and a day's fixtures are found without going through the rest of the competition
+    '''
+    def __init__(self, ttl=21600):
+        self.ttl = ttl
+        self.fetched = None
+        self.days = {}
+
+    def stale(self):
+        return self.fetched is None or time.time() - self.fetched > self.ttl
+
+    def fill(self, fixtures):
+        '''
+        replaces everything with fixtures, (kickoff, fixture) pairs
+        '''
+        self.days = {}
+        for kickoff, fixture in fixtures:
+            self.days.setdefault(date.fromtimestamp(kickoff), []).append((kickoff, fixture))
+        for fixtures in self.days.values():
+            fixtures.sort(key=lambda item: item[0])
+        self.fetched = time.time()
+
+    def on(self, day):
+        '''
+        sorted (kickoff, fixture) of the fixtures on day
+        '''
+        return self.days.get(day, [])
+
+    def kickoffs(self):
+        return [kickoff for fixtures in self.days.values() for kickoff, _ in fixtures]
@@ -1,84 +1,156 @@
-from bs4 import BeautifulSoup as BS
+from app.cards import FEATURES, MATCH_CLASS, LayoutError, parse_matches
+from app.changes import ChangeDetector
+from app.hedge import HedgedFetcher
+from app.lanes import slack_lane, upstream_lane
+from app.logsink import shared_sink
+from app.metrics import Metrics
+from app.poller import Poller
+from app.render import Renderer
+from app.schedule import PollScheduler
+from app.slack import SlackDispatcher
+from app.state import MatchState
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-import aiohttp
+from urllib.parse import quote_plus, urlsplit
 import asyncio
-import json
 import logging
 import os
-import random
 import sys
+import time
+
+EMOJIS = {
+    '08:00': ':clock8:', '09:00': ':clock9:', '10:00': ':clock10:',
+    '11:00': ':clock11:', '12:00': ':clock12:', '13:00': ':clock1:',
+    '14:00': ':clock2:', '15:00': ':clock3:', '16:00': ':clock4:',
+    '17:00': ':clock5:', '18:00': ':clock6:', '19:00': ':clock7:',
+    '20:00': ':clock8:', '21:00': ':clock9:', '22:00': ':clock10:',
+    'Already started': ':repeat:', 'Already ended': ':checkered_flag:',
+    'Russia': ':flag-ru:', 'Saudi Arabia': ':flag-sa:',
+    'Egypt': ':flag-eg:', 'Uruguay': ':flag-uy:',
+    'Morocco': ':flag-ma:', 'Iran': ':flag-ir:',
+    'Portugal': ':flag-pt:', 'Spain': ':flag-es:',
+    'France': ':flag-fr:', 'Australia': ':flag-au:',
+    'Argentina': ':flag-ar:', 'Iceland': ':flag-is:',
+    'Peru': ':flag-pe:', 'Denmark': ':flag-dk:',
+    'Croatia': ':flag-hr:', 'Costa Rica': ':flag-cr:',
+    'Serbia': ':flag-rs:', 'Germany': ':flag-de:',
+    'Mexico': ':flag-mx:', 'Brazil': ':flag-br:',
+    'Switzerland': ':flag-ch:', 'Sweden': ':flag-se:',
+    'South Korea': ':flag-kr:', 'Belgium': ':flag-be:',
+    'Panama': ':flag-pa:', 'Tunisia': ':flag-tn:',
+    'England': ':flag-england:', 'Colombia': ':flag-co:',
+    'Japan': ':flag-jp:', 'Poland': ':flag-pl:',
+    'Senegal': ':flag-sn:', 'Nigeria': ':flag-ng:'
+}
 
 
 class WorldCupSlackReporter:
-    def __init__(self):
+    def __init__(self, session=None, sem=None, dispatcher=None, metrics=None, sinks=None):
+        '''
+        session and sem (the upstream lane), dispatcher, metrics and sinks (log sinks by path, see app.logsink)
+        are given when they are shared with other reporters (see app.race and app.competitions), else they are made here
+        '''
         self.today_url = 'https://www.google.se/search?q=world+cup+today&hl=en'
         self.headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
         self.hours_to_add = 0
         self.matches = {}
         self.sleep = 43200
+        self.scheduler = PollScheduler()
+        self.poller = Poller()
 
-        self.sem = asyncio.Semaphore(5)
-        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False))
+        self.session, self.sem = upstream_lane() if session is None else (session, sem)
         self.logger = logging.getLogger(__file__)
         self.logger.setLevel(logging.INFO)
         logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+        self.metrics = Metrics() if metrics is None else metrics
+        self.slack_session = None  # only when the dispatcher is made here, a shared one is closed by whoever made it
+        if dispatcher is None:
+            self.slack_session, slack_sem = slack_lane()
+            dispatcher = SlackDispatcher(self.slack_session, slack_sem, self.logger)
+            dispatcher.metrics = self.metrics
+        self.dispatcher = dispatcher
+        self.fetcher = HedgedFetcher(self.session, self.sem)
+        self.fetcher.metrics = self.metrics
+        self.mirrors = []  # other google hosts (e.g. www.google.com) to ask as well when the first one is slow
         self.project_path = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+        self.banana_log = shared_sink(os.path.join(self.project_path, 'logs', 'banana.log'), sinks)
 
         self.slack_instances = []
         self.slack_payload = None
         self.output = True
+        self.renderer = None
+        self.features = FEATURES
+        self.strain = True
+        self.changes = ChangeDetector()
+        self.recorder = None
+        self.store = None
+        self.stream = None
+        self.executor = None
 
-    async def url_get(self, url):
+    async def url_get(self, url, changes_only=False):
         '''
         a normal web page download, with headers to make us look like a normal browser
+        it has self.fetcher.deadline seconds, and is hedged to the same page on self.mirrors if it is slow (see HedgedFetcher)
         the response i checked, and if not OK raises an exception
-        if all is OK, return a beautifulsoup'd page
+        if all is OK, return the match cards of the page as MatchCards (see app.cards)
+        with changes_only, None is returned without parsing if the match cards look exactly like last time
         '''
-        async def _get(url):
-            try:
-                async with self.sem, self.session.get(url, headers=self.headers) as response:
-                    return await response.read(), response.status
-            except aiohttp.client_exceptions.ClientConnectorError as e:
-                self.logger.error(e)
-                return e, 999
-        response = await _get(url)
+        started = time.perf_counter()
+        parts = urlsplit(url)
+        response = await self.fetcher.fetch([url] + [parts._replace(netloc=host).geturl() for host in self.mirrors], self.headers)
+        if response[1] == 999:
+            self.logger.error(response[0])
+        self.metrics.fetch_seconds.observe(time.perf_counter() - started)
+        self.metrics.fetch_responses.inc(status=response[1])
+        if self.recorder is not None:
+            self.recorder.add(url, response[1], response[0])
         if response[1] != 200:
             raise ConnectionError(f'did not get a 200 response: {response[0]}')
-        the_page = BS(response[0], 'html.parser')
-        return the_page
+        if changes_only and not self.changes.html(url, response[0], MATCH_CLASS.encode()):
+            return
+        started = time.perf_counter()
+        if self.executor is None:
+            matches = parse_matches(response[0], self.features, self.strain)
+        else:
+            loop = asyncio.get_event_loop()
+            matches = await loop.run_in_executor(self.executor, parse_matches, response[0], self.features, self.strain)
+        self.metrics.parse_seconds.observe(time.perf_counter() - started)
+        return matches
+
+    def apply(self, config):
+        '''
+        takes its settings from config (see app.config)
+        '''
+        self.slack_instances = list(config.slack_instances)
+        self.slack_payload = config.slack_payload
+        self.scheduler.jitter = config.poll_jitter
+        self.hours_to_add = config.hours_to_add
+        self.mirrors = list(config.hedge_hosts)
+        self.fetcher.deadline = config.fetch_deadline
+        if config.parse_workers:
+            self.use_workers(config.parse_workers)
+
+    def follow(self, query):
+        '''
+        report on the matches google shows for query (e.g. premier league today) instead of the world cup
+        '''
+        self.today_url = f'https://www.google.se/search?q={quote_plus(query)}&hl=en'
+
+    def use_workers(self, kind='process', workers=1):
+        '''
+        parse pages in a thread or process pool instead of on the event loop
+        '''
+        pool = ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor
+        self.executor = pool(max_workers=workers)
 
     @staticmethod
     def emojify(phrase):
         '''
         EMOJIFY ALL THE THINGS!
         yeah i know the dict looks like poo poo, but now at least it doesnt take up 50 rows
+        (and it lives at module level now, so it is only built once)
         '''
-        emojis = {
-            '08:00': ':clock8:', '09:00': ':clock9:', '10:00': ':clock10:',
-            '11:00': ':clock11:', '12:00': ':clock12:', '13:00': ':clock1:',
-            '14:00': ':clock2:', '15:00': ':clock3:', '16:00': ':clock4:',
-            '17:00': ':clock5:', '18:00': ':clock6:', '19:00': ':clock7:',
-            '20:00': ':clock8:', '21:00': ':clock9:', '22:00': ':clock10:',
-            'Already started': ':repeat:', 'Already ended': ':checkered_flag:',
-            'Russia': ':flag-ru:', 'Saudi Arabia': ':flag-sa:',
-            'Egypt': ':flag-eg:', 'Uruguay': ':flag-uy:',
-            'Morocco': ':flag-ma:', 'Iran': ':flag-ir:',
-            'Portugal': ':flag-pt:', 'Spain': ':flag-es:',
-            'France': ':flag-fr:', 'Australia': ':flag-au:',
-            'Argentina': ':flag-ar:', 'Iceland': ':flag-is:',
-            'Peru': ':flag-pe:', 'Denmark': ':flag-dk:',
-            'Croatia': ':flag-hr:', 'Costa Rica': ':flag-cr:',
-            'Serbia': ':flag-rs:', 'Germany': ':flag-de:',
-            'Mexico': ':flag-mx:', 'Brazil': ':flag-br:',
-            'Switzerland': ':flag-ch:', 'Sweden': ':flag-se:',
-            'South Korea': ':flag-kr:', 'Belgium': ':flag-be:',
-            'Panama': ':flag-pa:', 'Tunisia': ':flag-tn:',
-            'England': ':flag-england:', 'Colombia': ':flag-co:',
-            'Japan': ':flag-jp:', 'Poland': ':flag-pl:',
-            'Senegal': ':flag-sn:', 'Nigeria': ':flag-ng:'
-
-        }
-        return emojis.get(phrase, ':question:')
+        return EMOJIS.get(phrase, ':question:')
 
     @staticmethod
     def calc_seconds(timestring):
@@ -96,49 +168,29 @@ class WorldCupSlackReporter:
         return diff.seconds
 
     @staticmethod
-    def get_info(match, conlist):
+    def calc_kickoff(timestring):
         '''
-        in order to not have to type .contents[] a hundred times
+        epoch of today at timestring, None if there is no time in it
         '''
-        for i in conlist:
-            match = match.contents[i]
-        return match
-
-    @staticmethod
-    def goalfixer(goal):
-        '''
-        checks that there is a number present or returns 0
-        '''
-        if '(' in goal:
-            rg = goal.replace(' ', '').replace(')', '')
-            goal = rg.split('(')
-            try:
-                goal = (int(goal[0]), int(goal[1]))
-            except Exception:
-                goal = (0, 0)
-        else:
-            try:
-                goal = (int(goal[0]), None)
-            except Exception:
-                goal = (0, None)
-        return goal
+        try:
+            hour = int(timestring[:2])
+            minute = int(timestring[-2:])
+        except Exception:
+            return None
+        return datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0).timestamp()
 
     def _output(self, *message):
         if self.output:
             m = '{}\n'.format(' '.join(message))
             sys.stdout.write(m)
-            with open(os.path.join(self.project_path, 'logs', 'banana.log'), 'a+') as logfile:
-                logfile.write(f'{datetime.now()}: {m}')
+            self.banana_log.write(f'{datetime.now()}: {m}')
 
-    def status(self, text, match, conlist):
+    async def get_fixtures(self):
         '''
-        adds text to status if present, else just returns text
+        google only shows today's matches, so there is no calendar for the daemon (see app.daemon),
+        which then wakes up every day
         '''
-        try:
-            text += self.get_info(match, conlist).text.lower()
-        except Exception:
-            text = text
-        return text
+        return None
 
     async def get_todays_matches(self):
         '''
@@ -146,25 +198,21 @@ class WorldCupSlackReporter:
         preferably run in the morning to give everyone a schedule to look forward to
         '''
         try:
-            page = await self.url_get(self.today_url)
-        except ConnectionError as e:
+            matches = await self.url_get(self.today_url)
+        except (ConnectionError, LayoutError) as e:
             self.logger.error(e)
             return
-        matches = page.findAll('div', class_='imspo_mt__mtc-no')
         message = 'Today\'s matches:\n'
         for match in matches:
             status = 0
-            match = match.contents[0]
-            hteam = self.get_info(match, [4, 1, 1, 0]).text
-            hteamgoals = self.goalfixer(self.get_info(match, [4, 1, 0]).text)
-            ateam = self.get_info(match, [5, 1, 1, 0]).text
-            ateamgoals = self.goalfixer(self.get_info(match, [5, 1, 0]).text)
-            match_type = self.get_info(match, [1, 0, 0, 2]).text
-            try:
-                when = self.get_info(match, [2, 2, 0, 0, 0]).contents
-                when = when[0].text, when[1].text
-            except Exception as e:
-                statustext = self.status('', match, [2, 2, 0])
+            hteam = match.hteam
+            hteamgoals = match.hteamgoals
+            ateam = match.ateam
+            ateamgoals = match.ateamgoals
+            match_type = match.match_type
+            when = match.when
+            if when is None:
+                statustext = match.status
                 if not any(x in statustext for x in ('today', 'live', 'half')):
                     continue
                 when = ('Today', 'Already started') if 'ft' not in statustext else ('Today', 'Already ended')
@@ -175,140 +223,132 @@ class WorldCupSlackReporter:
             self.sleep = min(self.sleep, self.calc_seconds(start_time))
             match_id = hteam + ateam
             if match_id not in self.matches:
-                self.matches[match_id] = {
-                    'score': f'{hteamgoals[0]} - {ateamgoals[0]}',
-                    'goalcount': hteamgoals[0] + ateamgoals[0],
-                    'event_ids': [],
-                    'status': status,
-                    'hteam': hteam,
-                    'ateam': ateam,
-                    'half-time': False,
-                    'redflag': {
-                        'h': False,
-                        'a': False
-                    },
-                    'match_type': match_type.lower()
-                }
-            hinfo = self.get_info(match, [4, 1, 1, 0, 2, 0])
-            ainfo = self.get_info(match, [5, 1, 1, 0, 2, 0])
-            if hinfo.get('style') != 'display:none' and not self.matches.get(match_id).get('redflag').get('h'):
-                self.matches[match_id]['redflag']['h'] = True
-            if ainfo.get('style') != 'display:none' and not self.matches.get(match_id).get('redflag').get('a'):
-                self.matches[match_id]['redflag']['a'] = True
+                self.matches[match_id] = MatchState(
+                    match_id, hteam, ateam, match_type.lower(), status,
+                    kickoff=self.calc_kickoff(start_time), hgoals=hteamgoals[0], agoals=ateamgoals[0]
+                )
+            state = self.matches[match_id]
+            state.hred = state.hred or bool(match.hred)
+            state.ared = state.ared or bool(match.ared)
             add_score = ' vs ' if 'Already' not in when[1] else f' {hteamgoals[0]} - {ateamgoals[0]} '
             if all([hteamgoals[1], ateamgoals[1]]):
                 add_score = add_score.replace('-', f'({hteamgoals[1]}) - ({ateamgoals[1]})')
-            self._output(f'{self.matches.get(match_id)}')
+            self._output(f'{state}')
             message += f'{self.emojify(start_time)} *{start_time}*: {hteam} {self.emojify(hteam)}{add_score}{self.emojify(ateam)} {ateam} ({match_type})\n'
         if message == 'Today\'s matches:\n':
             self.sleep = 0
             return
         self._output(f'sleeping {self.sleep} seconds ({str(timedelta(seconds=self.sleep))})')
-        asyncio.ensure_future(self._slack_output(message.rstrip()))
+        await self._slack_output(message.rstrip())
 
     async def get_current_matches(self):
         '''
         main logic for getting updates in ongoing matches
         '''
         try:
-            page = await self.url_get(self.today_url)
-        except ConnectionError as e:
+            matches = await self.url_get(self.today_url, changes_only=True)
+        except (ConnectionError, LayoutError) as e:
             self.logger.error(e)
             return
-        matches = page.findAll('div', class_='imspo_mt__mtc-no')
+        if matches is None:
+            return
+        seen = time.time()
         local_matches = []
         for match in matches:
-            match = match.contents[0]
             message = ''
-            hteam = self.get_info(match, [4, 1, 1, 0]).text
-            hteamgoals = self.goalfixer(self.get_info(match, [4, 1, 0]).text)
-            ateam = self.get_info(match, [5, 1, 1, 0]).text
-            ateamgoals = self.goalfixer(self.get_info(match, [5, 1, 0]).text)
+            hteam = match.hteam
+            hteamgoals = match.hteamgoals
+            ateam = match.ateam
+            ateamgoals = match.ateamgoals
             match_id = hteam + ateam
-            if match_id not in self.matches:
+            state = self.matches.get(match_id)
+            if state is None:
                 continue
             self._output(f'{hteam} {hteamgoals[0]} - {ateamgoals[0]} {ateam}')
             local_matches.append(match_id)
-            status = ''
-            status = self.status(status, match, [2, 2, 0])
+            status = match.status
             self._output(f'{match_id} status: {status}')
-            hinfo = self.get_info(match, [4, 1, 1, 0, 2, 0])
-            ainfo = self.get_info(match, [5, 1, 1, 0, 2, 0])
-            if hinfo.get('style') != 'display:none' and not self.matches.get(match_id).get('redflag').get('h'):
+            if match.hred and not state.hred:
                 message += f'{hteam} just received a red card!\n'
-                self.matches[match_id]['redflag']['h'] = True
+                self.metrics.events.inc(type='red_card')
+                state.hred = True
                 self._output(f'{hteam} red flag update')
-            if ainfo.get('style') != 'display:none' and not self.matches.get(match_id).get('redflag').get('a'):
+            if match.ared and not state.ared:
                 message += f'{ateam} just received a red card!\n'
-                self.matches[match_id]['redflag']['a'] = True
+                self.metrics.events.inc(type='red_card')
+                state.ared = True
                 self._output(f'{ateam} red flag update')
-            score = f'{hteamgoals[0]} - {ateamgoals[0]}'
 
-            if any(x in status for x in ('live', 'pågår')) and self.matches.get(match_id).get('status') == 0:
+            if any(x in status for x in ('live', 'pågår')) and state.status == 0:
                 message += f'{hteam} {self.emojify(hteam)} vs {self.emojify(ateam)} {ateam} just started!\n'
-                self.matches[match_id]['status'] = 1
+                self.metrics.events.inc(type='start')
+                state.status = 1
+                state.time = time.time()
                 self._output(f'{match_id} match start update')
 
-            if self.matches.get(match_id).get('status') in (0, 2):
+            if state.status in (0, 2):
                 continue
 
-            if score != self.matches.get(match_id).get('score'):
+            if (hteamgoals[0], ateamgoals[0]) != (state.hgoals, state.agoals):
                 message += f'GOOOOOOOAL!\n{hteam} {self.emojify(hteam)} {hteamgoals[0]} - {ateamgoals[0]} {self.emojify(ateam)} {ateam}\n'
-                if (hteamgoals[0] + ateamgoals[0]) <= self.matches.get(match_id).get('goalcount'):
+                self.metrics.events.inc(type='goal')
+                if (hteamgoals[0] + ateamgoals[0]) <= state.goalcount:
                     message = message.replace('GOOOOOOOAL!', 'Score update:')
-                self.matches[match_id]['goalcount'] = hteamgoals[0] + ateamgoals[0]
-                self.matches[match_id]['score'] = score
+                state.hgoals, state.agoals = hteamgoals[0], ateamgoals[0]
                 self._output(f'{match_id} goal update')
 
-            if any(x in status for x in ('half–time', 'halvtid', 'ht', 'half')) and not self.matches.get(match_id).get('half-time'):
-                self.matches[match_id]['half-time'] = True
+            if any(x in status for x in ('half–time', 'halvtid', 'ht', 'half')) and not state.half_time:
+                state.half_time = True
                 message += f'Half-time: {hteam} {self.emojify(hteam)} {hteamgoals[0]} vs {ateamgoals[0]} {self.emojify(ateam)} {ateam}\n'
+                self.metrics.events.inc(type='half_time')
                 self._output(f'{match_id} half-time update')
 
             if any(x in status for x in ('ended', 'full-time', 'ft', 'full')):
-                hwin = self.get_info(match, [4, 2, 0])
-                awin = self.get_info(match, [5, 2, 0])
-                if hwin.get('style') == 'display:none' and awin.get('style') == 'display:none' and 'group' not in self.matches.get(match_id).get('match_type'):
+                if not match.hwin and not match.awin and 'group' not in state.match_type:
                     continue
                 separator = '-'
                 if all([hteamgoals[1], ateamgoals[1]]):
                     separator = separator.replace('-', f'({hteamgoals[1]}) - ({ateamgoals[1]})')
                 message += f'Match ended! Final score:\n{hteam} {self.emojify(hteam)} {hteamgoals[0]} {separator} {ateamgoals[0]} {self.emojify(ateam)} {ateam}\n'
-                self.matches[match_id]['status'] = 2
+                self.metrics.events.inc(type='end')
+                state.status = 2
                 self._output(f'{match_id} end of match update')
-            asyncio.ensure_future(self._slack_output(message.rstrip()))
+            await self._slack_output(message.rstrip(), seen)
 
     async def monitor(self):
         '''
         assure that current matches are scraped regularily
-        scraping is done between 55 and 87 seconds randomly in order to potentially avoid suspicious acitivity
+        how often is decided by self.scheduler from the state of the matches: often while they are live,
+        rarely in between, and not at all once they are all done
+        the delays are jittered in order to potentially avoid suspicious acitivity
+        only one scrape is running at a time, see Poller
         '''
-        if len(self.matches) > 0:
-            all_done = False
-        else:
-            all_done = True
-        while not all_done:
-            asyncio.ensure_future(self.get_current_matches())
-            await asyncio.sleep(random.choice(range(55, 87)))
-            if all([x.get('status') == 2 for k, x in self.matches.items()]):
-                all_done = True
+        await self.poller.run(self)
 
-    async def _slack_output(self, message):
+    async def _slack_output(self, message, seen=None):
         '''
-        sends message to all the slack clients
+        queues message for all the slack clients, empty messages are dropped
         '''
-        async def _send(url, output):
-            try:
-                async with self.sem, self.session.post(url, data=output) as response:
-                    return await response.read(), response.status
-            except aiohttp.client_exceptions.ClientConnectorError as e:
-                self.logger.error(e)
-        for si in self.slack_instances:
-            output = dict(self.slack_payload)
-            if si.get('participants'):
-                for country, name in si.get('participants').items():
-                    newtext = f'{country} ({name})'
-                    message = message.replace(country, newtext)
-            output['text'] = message
+        if not message:
+            return
+        if self.renderer is None or self.renderer.instances is not self.slack_instances:
+            self.renderer = Renderer(self.slack_instances)
+        for i, si in enumerate(self.slack_instances):
+            output = dict(si.get('slack_payload') or self.slack_payload)
+            output['text'] = self.renderer.render(message, i)
             output['channel'] = si.get('channel')
-            asyncio.ensure_future(_send(si.get('webhook'), json.dumps(output)))
+            self.dispatcher.put(si.get('webhook'), output, seen)
+
+    async def close(self):
+        '''
+        posts whatever is left to slack, then lets go of the sessions and the parsing workers
+        '''
+        await self.dispatcher.flush()
+        await self.session.close()
+        if self.slack_session is not None:
+            await self.slack_session.close()
+        await self.banana_log.close()
+        if self.recorder is not None:
+            await self.recorder.close()
+        if self.executor is not None:
+            self.executor.shutdown()
@@ -0,0 +1,78 @@
+from collections import deque
+import aiohttp
+import asyncio
+import time
+
+
+class HedgedFetcher:
+    '''
+    gets a page within deadline seconds, hedging against a slow upstream
+    * the first url is asked first, if it has not answered after the percentile of the latencies seen lately,
+      the next one (the same page somewhere else) is asked as well, and so on
+    * the first 200 wins and the requests still running are cancelled, an error moves on to the next url straight away
+    * with no 200 by the deadline, the last error (or a timeout) is returned with status 999
+    until min_samples latencies have been seen, hedging waits deadline / 4
+    if metrics (see app.metrics) is set, hedged fetches are counted there by which request won
+    '''
+    def __init__(self, session, sem, deadline=10, percentile=0.95, window=200, min_samples=20):
+        self.session = session
+        self.sem = sem
+        self.deadline = deadline
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.metrics = None
+
+    def hedge_after(self):
+        if len(self.latencies) < self.min_samples:
+            return self.deadline / 4
+        latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * self.percentile), len(latencies) - 1)]
+
+    async def _get(self, url, headers):
+        started = time.perf_counter()
+        try:
+            async with self.sem, self.session.get(url, headers=headers) as response:
+                body, status = await response.read(), response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return e, 999
+        if status == 200:
+            self.latencies.append(time.perf_counter() - started)
+        return body, status
+
+    async def fetch(self, urls, headers=None):
+        '''
+        (body, status) of the first url to answer 200, see above
+        '''
+        loop = asyncio.get_event_loop()
+        ends = loop.time() + self.deadline
+        waiting = list(urls)
+        running = {}
+        sent = 0
+        result = (asyncio.TimeoutError(f'no answer within {self.deadline} seconds'), 999)
+        try:
+            while waiting or running:
+                if waiting:
+                    url = waiting.pop(0)
+                    running[asyncio.ensure_future(self._get(url, headers))] = url
+                    sent += 1
+                    wait = self.hedge_after() if waiting else None
+                else:
+                    wait = None
+                remaining = ends - loop.time()
+                if remaining <= 0:
+                    break
+                done, _ = await asyncio.wait(set(running), timeout=min(wait or remaining, remaining), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    won = running.pop(task)
+                    if result[1] == 200:
+                        if self.metrics is not None and sent > 1:
+                            self.metrics.hedges.inc(won='primary' if won == urls[0] else 'alternate')
+                        return result
+                if not done and not waiting:
+                    break
+        finally:
+            for task in running:
+                task.cancel()
+        return result
@@ -0,0 +1,128 @@
+from app.logsink import LogSink
+from datetime import date, datetime
+import asyncio
+import json
+import os
+
+
+class Journal:
+    '''
+    every event found (see app.events), appended to path as compact json lines
+    where each day's events are in the file is kept in memory by match (built with one read of the file when opened),
+    so a day or a match is read back without going through the rest
+    it works as a reporter's stream (see app.poller), and passes every event on to stream if given
+    events are written through a LogSink (never rotated), so publishing never waits for the disk,
+    and what is read back (events, replay, digest) is read after the sink is flushed, in the default executor
+    a half-written last line (the process dying mid-write) is cut off when opening, other lines that are not events are skipped
+    '''
+    def __init__(self, path, stream=None):
+        self.path = path
+        self.stream = stream
+        self.index = {}  # day: {match_id: [offsets]}
+        self.size = 0
+        self.sink = LogSink(path, max_bytes=float('inf'), max_age=float('inf'))
+        try:
+            with open(path, 'rb') as journal_file:
+                for line in journal_file:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        self._index(json.loads(line), self.size)
+                    except (ValueError, AttributeError, TypeError):  # not an event, kept but never read back
+                        pass
+                    self.size += len(line)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            return
+        if self.size < os.path.getsize(path):
+            os.truncate(path, self.size)
+
+    @staticmethod
+    def day(event):
+        return date.fromtimestamp(event.get('time')).isoformat()
+
+    def _index(self, event, offset):
+        self.index.setdefault(self.day(event), {}).setdefault(event.get('match'), []).append(offset)
+
+    def publish(self, event):
+        line = (json.dumps(event, separators=(',', ':')) + '\n').encode()
+        self.sink.write(line)
+        self._index(event, self.size)
+        self.size += len(line)
+        if self.stream is not None:
+            self.stream.publish(event)
+
+    async def events(self, day=None):
+        '''
+        the events of day (today by default) by match_id, in the order they happened
+        '''
+        matches = self.index.get((day or date.today()).isoformat(), {})
+        if not matches:
+            return {}
+        await self.sink.flush()
+        return await asyncio.get_event_loop().run_in_executor(None, self._read, dict(matches))
+
+    def _read(self, matches):
+        events = {}
+        with open(self.path, 'rb') as journal_file:
+            for match_id, offsets in matches.items():
+                events[match_id] = []
+                for offset in offsets:
+                    journal_file.seek(offset)
+                    events[match_id].append(json.loads(journal_file.readline()))
+        return events
+
+    async def replay(self, matches, day=None):
+        '''
+        brings the MatchStates in matches up to date with the events of day
+        they are found by their own match_id, so matches can be keyed any way (see Competitions.matches)
+        '''
+        states = {}
+        for state in matches.values():
+            states.setdefault(state.match_id, []).append(state)
+        for match_id, events in (await self.events(day)).items():
+            for state in states.get(match_id, ()):
+                self.apply(state, events)
+        return matches
+
+    @staticmethod
+    def apply(state, events):
+        for event in events:
+            kind = event.get('type')
+            if kind == 'start':
+                state.status = max(state.status, 1)
+                state.time = state.time or event.get('time')
+            elif kind == 'goal':
+                state.hgoals, state.agoals = event.get('hgoals'), event.get('agoals')
+            elif kind == 'red_card':
+                setattr(state, 'hred' if event.get('side') == 'home' else 'ared', True)
+            elif kind == 'half_time':
+                state.half_time = True
+            elif kind == 'end':
+                state.status = 2
+        return state
+
+    async def digest(self, day=None):
+        '''
+        a recap of every match of day with an event, as a slack message
+        '''
+        day = day or date.today()
+        message = f'Results of {day.isoformat()}:\n'
+        for events in (await self.events(day)).values():
+            last = events[-1]
+            home, away = last.get('home'), last.get('away')
+            ended = any(event.get('type') == 'end' for event in events)
+            message += f'*{home} {last.get("hgoals")} - {last.get("agoals")} {away}*{"" if ended else " (not over yet)"}\n'
+            for event in events:
+                team = home if event.get('side') == 'home' else away
+                at = datetime.fromtimestamp(event.get('time')).strftime('%H:%M')
+                if event.get('type') == 'goal':
+                    message += f'    {at} goal, {team}\n'
+                elif event.get('type') == 'red_card':
+                    message += f'    {at} red card, {team}\n'
+        if message == f'Results of {day.isoformat()}:\n':
+            return ''
+        return message.rstrip()
+
+    async def close(self):
+        await self.sink.close()
@@ -0,0 +1,21 @@
+'''
+the two kinds of i/o the reporters do get a lane each: a session with its own connection pool, and a semaphore
+so a burst of slack posts after a goal can never take the connections or the slots the next poll needs
+'''
+import aiohttp
+import asyncio
+
+UPSTREAM_LIMIT = 5
+UPSTREAM_KEEPALIVE = 60  # polls are 15-30 seconds apart while matches are live, keep the connection to upstream open in between
+SLACK_LIMIT = 10  # all webhooks are on hooks.slack.com, so this is per host as well
+SLACK_KEEPALIVE = 30
+
+
+def upstream_lane(limit=UPSTREAM_LIMIT):
+    connector = aiohttp.TCPConnector(ssl=False, limit=limit, keepalive_timeout=UPSTREAM_KEEPALIVE)
+    return aiohttp.ClientSession(connector=connector), asyncio.Semaphore(limit)
+
+
+def slack_lane(limit=SLACK_LIMIT):
+    connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit, keepalive_timeout=SLACK_KEEPALIVE)
+    return aiohttp.ClientSession(connector=connector), asyncio.Semaphore(limit)
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import time
+
+
+class LogSink:
+    '''
+    a buffered log file, written from a worker thread so the event loop never waits for the disk
+    lines are kept in memory and flushed every self.interval seconds, or sooner if the buffer grows past buffer_size
+    the file is rotated (path -> path.1 -> path.2 ...) once it is larger than max_bytes or older than max_age seconds
+    '''
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, max_age=86400, backups=5, interval=5, buffer_size=64 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self.interval = interval
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.size = 0
+        self.lock = None
+        self.flusher = None
+        try:
+            self.opened = os.stat(path).st_mtime
+        except OSError:
+            self.opened = time.time()
+
+    def write(self, data):
+        '''
+        queues data (str or bytes) for the file, without touching the disk
+        '''
+        if isinstance(data, str):
+            data = data.encode()
+        self.buffer.append(data)
+        self.size += len(data)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(self._take())
+            return
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.ensure_future(self._flush_every())
+        if self.size > self.buffer_size:
+            asyncio.ensure_future(self.flush())
+
+    def _take(self):
+        chunks = self.buffer
+        self.buffer = []
+        self.size = 0
+        return chunks
+
+    async def _flush_every(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            chunks = self._take()
+            if chunks:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, self._write, chunks)
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        os.replace(self.path, f'{self.path}.1')
+        self.opened = time.time()
+
+    def _write(self, chunks):
+        try:
+            too_big = os.path.getsize(self.path) > self.max_bytes
+        except OSError:
+            too_big = None
+        if too_big is not None and (too_big or time.time() - self.opened > self.max_age):
+            self._rotate()
+        with open(self.path, 'ab') as logfile:
+            logfile.write(b''.join(chunks))
+
+    async def close(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        await self.flush()
+
+
+def shared_sink(path, sinks=None):
+    '''
+    the LogSink for path, taken from (or added to) sinks, a dict by path, if given
+    so reporters writing to the same file share one sink, and with it the lock and the rotation
+    '''
+    if sinks is None:
+        return LogSink(path)
+    if path not in sinks:
+        sinks[path] = LogSink(path)
+    return sinks[path]
@@ -0,0 +1,148 @@
+from bisect import bisect_left
+
+BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+STATES = {0: 'scheduled', 1: 'live', 2: 'ended'}
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _labels(key):
+    if not key:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in key) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = {}
+        self.parent = None  # see Metrics.child
+
+    def inc(self, amount=1, **labels):
+        key = _key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+        if self.parent is not None:
+            self.parent.inc(amount, **labels)
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, key, value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[_key(labels)] = value
+        if self.parent is not None:
+            self.parent.set(value, **labels)
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.values = {}  # labels: [counts per bucket (+Inf last), sum, count]
+        self.parent = None  # see Metrics.child
+
+    def observe(self, value, **labels):
+        key = _key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+        if self.parent is not None:
+            self.parent.observe(value, **labels)
+
+    def samples(self):
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (None,), counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket', key + (('le', '+Inf' if bound is None else repr(bound)),), cumulative
+            yield f'{self.name}_sum', key, total
+            yield f'{self.name}_count', key, count
+
+    def sum(self):
+        '''
+        sum of everything observed, over all labels
+        '''
+        return sum(entry[1] for entry in self.values.values())
+
+
+class Metrics:
+    '''
+    what a reporter keeps count of about itself, rendered in prometheus text format
+    '''
+    def __init__(self):
+        self.fetch_seconds = Histogram('sportsball_fetch_seconds', 'Time to download a response from upstream.')
+        self.fetch_responses = Counter('sportsball_fetch_responses_total', 'Upstream responses by status code (999 is a connection error).')
+        self.hedges = Counter('sportsball_fetch_hedges_total', 'Fetches that were hedged, by which request answered first.')
+        self.parse_seconds = Histogram('sportsball_parse_seconds', 'Time to parse a response and extract the matches.')
+        self.matches = Gauge('sportsball_matches', 'Tracked matches by state.')
+        self.events = Counter('sportsball_events_total', 'Events detected by type.')
+        self.slack_queue = Gauge('sportsball_slack_queue_depth', 'Messages waiting to be posted to slack.')
+        self.slack_post_seconds = Histogram('sportsball_slack_post_seconds', 'Time for slack to answer a post.')
+        self.slack_posts = Counter('sportsball_slack_posts_total', 'Slack posts by status code (999 is a connection error).')
+        self.event_lag = Histogram('sportsball_event_to_slack_seconds', 'From the poll that first saw an event to slack answering 200.')
+        self.all = [
+            self.fetch_seconds, self.fetch_responses, self.hedges, self.parse_seconds, self.matches, self.events,
+            self.slack_queue, self.slack_post_seconds, self.slack_posts, self.event_lag
+        ]
+
+    def child(self):
+        '''
+        metrics for one of several reporters run together (see app.race and app.competitions),
+        kept apart so each reporter still knows its own (see app.profiling), and added to these as well, which are the ones served
+        '''
+        child = Metrics()
+        for mine, theirs in zip(self.all, child.all):
+            theirs.parent = mine
+        return child
+
+    def update(self, reporter):
+        '''
+        gauges are read off the reporter when asked for, rather than kept up to date all the time
+        '''
+        counts = dict.fromkeys(STATES.values(), 0)
+        for match in reporter.matches.values():
+            counts[STATES.get(match.status)] += 1
+        for state, count in counts.items():
+            self.matches.set(count, state=state)
+        self.slack_queue.set(sum(queue.qsize() for queue in reporter.dispatcher.queues.values()))
+
+    def render(self):
+        lines = []
+        for metric in self.all:
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, key, value in metric.samples():
+                lines.append(f'{name}{_labels(key)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+async def serve(reporter, port, host='0.0.0.0'):
+    '''
+    serves reporter.metrics on http://host:port/metrics, returns the runner (call .cleanup() on it to stop)
+    '''
+    from aiohttp import web  # only when metrics are served, every reporter imports this module
+
+    async def handler(request):
+        reporter.metrics.update(reporter)
+        return web.Response(body=reporter.metrics.render().encode(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+    app = web.Application()
+    app.router.add_get('/metrics', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
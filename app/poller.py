@@ -0,0 +1,77 @@
+from app.events import changes, snapshot
+import asyncio
+
+
+class Poller:
+    '''
+    runs the poll loop of a reporter
+    * only one poll is in flight at a time, the next one is not started before the last one is done
+    * a poll that takes longer than self.timeout seconds is cancelled
+    * the loop ends once every tracked match is done
+    * every task started goes into self.tasks, which never grows beyond self.max_tasks
+    * if profiler is set (see app.profiling), every poll is run through it
+    * if the reporter has a store (see app.store), the matches are saved to it after every poll
+    * if the reporter has a stream (see app.stream), what changed in a poll is published to it
+    * if the reporter has changes (see app.changes), what a poll fetched only counts as seen once the poll has gone through
+    '''
+    def __init__(self, timeout=60, max_tasks=16):
+        self.timeout = timeout
+        self.max_tasks = max_tasks
+        self.tasks = set()
+        self.profiler = None
+
+    def spawn(self, coro):
+        '''
+        starts coro as a tracked task, or refuses (and returns None) if there are too many running already
+        '''
+        if len(self.tasks) >= self.max_tasks:
+            coro.close()
+            return None
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def poll(self, reporter):
+        '''
+        one supervised call to reporter.get_current_matches
+        '''
+        if reporter.stream is not None:
+            before = {match_id: snapshot(state) for match_id, state in reporter.matches.items()}
+        if self.profiler is None:
+            task = self.spawn(reporter.get_current_matches())
+        else:
+            task = self.spawn(self.profiler.run(reporter, reporter.get_current_matches))
+        if task is None:
+            reporter.logger.error(f'{len(self.tasks)} tasks already running, skipping poll')
+            return
+        detector = getattr(reporter, 'changes', None)
+        try:
+            await asyncio.wait_for(task, self.timeout)
+        except asyncio.TimeoutError:
+            reporter.logger.error(f'poll took more than {self.timeout} seconds, cancelled it')
+            if detector is not None:
+                detector.rollback()
+        except Exception as e:
+            reporter.logger.error(e)
+            if detector is not None:
+                detector.rollback()
+        else:
+            if detector is not None:
+                detector.commit()
+        if reporter.stream is not None:
+            for event in changes(before, reporter.matches):
+                reporter.stream.publish(event)
+
+    async def run(self, reporter):
+        '''
+        polls until reporter.scheduler says all of reporter.matches are done
+        '''
+        while any(m.status != 2 for m in reporter.matches.values()):
+            await self.poll(reporter)
+            if reporter.store is not None:
+                await reporter.store.save(reporter.matches)
+            delay = reporter.scheduler.next_delay(reporter.matches)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
@@ -0,0 +1,92 @@
+from app.logsink import LogSink
+from datetime import datetime
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import time
+
+
+class Profiled:
+    '''
+    awaits coro with profile on only while coro itself runs, not while it waits,
+    so whatever else the loop runs in between (slack workers, other pollers, stream handlers) is not charged to it
+    '''
+    def __init__(self, coro, profile):
+        self.coro = coro
+        self.profile = profile
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            self.profile.enable()
+            try:
+                future = self.coro.send(value) if error is None else self.coro.throw(error)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self.profile.disable()
+            try:
+                value, error = (yield future), None
+            except BaseException as e:
+                value, error = None, e
+
+
+class PollProfiler:
+    '''
+    profiles the polls it is handed (see Poller.profiler), and writes under path:
+    * profile-<started>.prof: cProfile stats of all polls so far, written every dump_every polls and on close (open with pstats or snakeviz)
+    * polls-<started>.jsonl: one line per poll with how long it took, split in stages
+    the stages come from the reporter's metrics (see app.metrics), so nothing extra is timed in the reporters,
+    with several reporters (see app.race and app.competitions) each has metrics of its own, so one poll is not charged another's stages
+    diff is whatever the poll spent outside of fetching and parsing (diffing, rendering and queueing messages)
+    '''
+    def __init__(self, path, dump_every=20):
+        started = datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.stats_path = os.path.join(path, f'profile-{started}.prof')
+        self.trace = LogSink(os.path.join(path, f'polls-{started}.jsonl'))
+        self.profile = cProfile.Profile()
+        self.dump_every = dump_every
+        self.polls = 0
+
+    @staticmethod
+    def snapshot(metrics):
+        return metrics.fetch_seconds.sum(), metrics.parse_seconds.sum(), sum(metrics.events.values.values())
+
+    def dump(self):
+        '''
+        writes the stats so far in the default executor, returns the future
+        '''
+        stats = pstats.Stats(self.profile)
+        return asyncio.get_event_loop().run_in_executor(None, stats.dump_stats, self.stats_path)
+
+    async def run(self, reporter, poll):
+        '''
+        awaits poll() with the profiler on (see Profiled)
+        '''
+        before = self.snapshot(reporter.metrics)
+        started = time.perf_counter()
+        try:
+            await Profiled(poll(), self.profile)
+        finally:
+            total = time.perf_counter() - started
+            after = self.snapshot(reporter.metrics)
+            fetch, parse, events = (a - b for a, b in zip(after, before))
+            self.trace.write(json.dumps({
+                't': datetime.now().isoformat(timespec='seconds'),
+                'source': reporter.__module__.rsplit('.', 1)[-1],
+                'total': round(total, 6),
+                'fetch': round(fetch, 6),
+                'parse': round(parse, 6),
+                'diff': round(max(total - fetch - parse, 0), 6),
+                'events': events
+            }) + '\n')
+            self.polls += 1
+            if self.polls % self.dump_every == 0:
+                self.dump()
+
+    async def close(self):
+        if self.polls:
+            await self.dump()
+        await self.trace.close()
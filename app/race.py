@@ -0,0 +1,189 @@
+from app.fixtures import FixtureCalendar
+from app.events import event, happened, snapshot
+from app.lanes import slack_lane
+from app.metrics import Metrics
+from app.slack import SlackDispatcher
+from app.state import MatchState
+from datetime import date
+import asyncio
+import logging
+import time
+
+
+class Race:
+    '''
+    polls several reporters (google, fd, wc) at the same time and posts every event once,
+    as soon as the first of them sees it
+    * every source polls on its own schedule, so a slow or failing source never holds up the others
+    * the sources do not post anything themselves, what they found is read off their MatchStates (see app.state)
+    * matches are keyed by team names, aliases maps a provider's name for a team to the one to use (e.g. Korea Republic: South Korea)
+    * self.matches is what has been posted so far, an event is posted when a source is ahead of it
+    * posts go through the first source's slack output (participants and all), and today's matches
+      are announced with the first source that found any
+    * a source without matches (its get_todays_matches failed) is set up again, at most every retry seconds
+    * the sources are made here (from the reporter classes given), sharing one slack dispatcher (the only one posting),
+      the metrics (see Metrics.child) and the log sinks (so two sources never rotate the same file)
+    looks enough like a reporter to be used by sportsball.py, app.daemon and app.metrics
+    '''
+    def __init__(self, reporters, aliases=None, retry=300):
+        self.slack_session, slack_sem = slack_lane()
+        self.logger = logging.getLogger(__file__)
+        self.logger.setLevel(logging.INFO)
+        self.dispatcher = SlackDispatcher(self.slack_session, slack_sem, self.logger)
+        self.metrics = Metrics()
+        self.dispatcher.metrics = self.metrics
+        sinks = {}
+        self.sources = []
+        for reporter in reporters:
+            metrics = self.metrics.child()
+            metrics.events.parent = None  # events are counted here once, as they are posted, not by every source that finds them
+            self.sources.append(reporter(dispatcher=self.dispatcher, metrics=metrics, sinks=sinks))
+        self.aliases = aliases or {}
+        self.primary = self.sources[0]
+        self.post = self.primary._slack_output
+        self.outbox = {}
+        for source in self.sources:
+            source._slack_output = self._collector(source)
+        self.scheduler = self.primary.scheduler
+        self.poller = self.primary.poller
+        self.project_path = self.primary.project_path
+        self.store = None
+        self.stream = None
+        self.matches = {}
+        self.sleep = 0
+        self.day = None  # when the sources were last set up
+        self.retry = retry
+        self.set_up = {}  # source: when it was last set up
+
+    def _collector(self, source):
+        async def collect(message, seen=None):
+            self.outbox.setdefault(source, []).append(message)
+        return collect
+
+    @staticmethod
+    def name(source):
+        return source.__module__.rsplit('.', 1)[-1]
+
+    def teams(self, state):
+        return self.aliases.get(state.hteam, state.hteam), self.aliases.get(state.ateam, state.ateam)
+
+    def key(self, state):
+        return '{} - {}'.format(*self.teams(state)).lower()
+
+    async def get_fixtures(self):
+        '''
+        every kickoff any source knows of, None if none of them has a schedule
+        '''
+        calendar = None
+        for kickoffs in await asyncio.gather(*(source.get_fixtures() for source in self.sources)):
+            if kickoffs is None:
+                continue
+            calendar = calendar or FixtureCalendar()
+            for kickoff in kickoffs:
+                calendar.add(kickoff)
+        if calendar is None:
+            return None
+        return [kickoff for day in calendar.dates for kickoff in calendar.kickoffs(day)]
+
+    async def setup(self, sources=None):
+        '''
+        sets up today's matches in sources (every source by default), and adds the ones not already known to self.matches
+        '''
+        sources = sources or self.sources
+        for source in sources:
+            self.outbox.pop(source, None)
+            source.matches = {}
+        await asyncio.gather(*(source.get_todays_matches() for source in sources))
+        self.day = date.today()
+        self.set_up.update(dict.fromkeys(sources, time.time()))
+        for source in sources:
+            for state in source.matches.values():
+                key = self.key(state)
+                if key not in self.matches:
+                    self.matches[key] = MatchState(
+                        key, *self.teams(state), state.match_type, state.status,
+                        kickoff=state.kickoff, hgoals=state.hgoals, agoals=state.agoals
+                    )
+
+    async def get_todays_matches(self):
+        '''
+        sets up today's matches and announces them, with the first source that found any
+        '''
+        await self.setup()
+        for source in self.sources:
+            if source.matches and self.outbox.get(source):
+                await self.post('\n'.join(self.outbox.get(source)))
+                break
+
+    def merge(self, source, seen):
+        '''
+        what source has seen that has not been posted yet, as one message
+        '''
+        message = ''
+        for state in source.matches.values():
+            match = self.matches.get(self.key(state))
+            if match is None or match.status == 2:
+                continue
+            hteam, ateam = match.hteam, match.ateam
+            before = snapshot(match)
+            if state.status >= 1 and match.status == 0:
+                message += f'{hteam} vs {ateam} just started!\n'
+                match.status = 1
+                match.time = seen
+            if state.hred and not match.hred:
+                message += f'{hteam} just received a red card!\n'
+                match.hred = True
+            if state.ared and not match.ared:
+                message += f'{ateam} just received a red card!\n'
+                match.ared = True
+            if state.goalcount > match.goalcount:
+                message += f'GOOOOOOOAL!\n{hteam} {state.hgoals} - {state.agoals} {ateam}\n'
+                match.hgoals, match.agoals = state.hgoals, state.agoals
+            if state.half_time and not match.half_time:
+                message += f'Half-time: {hteam} {match.hgoals} vs {match.agoals} {ateam}\n'
+                match.half_time = True
+            if state.status == 2:
+                message += f'Match ended! Final score:\n{hteam} {match.hgoals} - {match.agoals} {ateam}\n'
+                match.status = 2
+            for kind, side in happened(before, match):
+                self.metrics.events.inc(type=kind, source=self.name(source))
+                if self.stream is not None:
+                    self.stream.publish(dict(event(kind, side, match, seen), source=self.name(source)))
+        return message.rstrip()
+
+    async def follow(self, source):
+        '''
+        polls source until every match has ended, posting whatever it is first to see
+        '''
+        while any(m.status != 2 for m in self.matches.values()):
+            if not source.matches and time.time() - self.set_up.get(source, 0) > self.retry:
+                # its get_todays_matches failed (or found nothing), it is set up again to still be there if the others fail
+                await self.setup([source])
+                self.outbox.pop(source, None)
+            await source.poller.poll(source)
+            self.outbox.pop(source, None)
+            seen = time.time()
+            message = self.merge(source, seen)
+            if message:
+                await self.post(message, seen)
+                if self.store is not None:
+                    await self.store.save(self.matches)
+            delay = source.scheduler.next_delay(self.matches)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+
+    async def monitor(self):
+        '''
+        follows every source at the same time, the sources are set up first if today's matches came from a store
+        '''
+        if self.day != date.today():
+            await self.setup()
+        await asyncio.gather(*(self.follow(source) for source in self.sources))
+
+    async def _slack_output(self, message, seen=None):
+        await self.post(message, seen)
+
+    async def close(self):
+        await asyncio.gather(*(source.close() for source in self.sources))
+        await self.slack_session.close()
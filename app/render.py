@@ -0,0 +1,46 @@
+from collections import OrderedDict
+import re
+
+
+class Renderer:
+    '''
+    compiles the participants of every slack instance into one regex each,
+    so every message is rewritten in a single pass per instance instead of one replace per country
+    rendered messages are cached by message and instance
+    '''
+    def __init__(self, slack_instances, cache_size=512):
+        self.instances = slack_instances
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.tables = [self.compile(si.get('participants')) for si in slack_instances]
+
+    @staticmethod
+    def compile(participants):
+        '''
+        longest names first, so that a country that is part of another country's name never wins
+        '''
+        if not participants:
+            return None
+        names = sorted(participants, key=len, reverse=True)
+        pattern = re.compile('|'.join(re.escape(name) for name in names))
+        substitutions = {country: f'{country} ({name})' for country, name in participants.items()}
+        return pattern, substitutions
+
+    def render(self, message, index):
+        '''
+        returns message as it should look for slack instance number index
+        '''
+        key = (message, index)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        table = self.tables[index]
+        if table is None:
+            text = message
+        else:
+            pattern, substitutions = table
+            text = pattern.sub(lambda m: substitutions[m.group(0)], message)
+        self.cache[key] = text
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return text
@@ -0,0 +1,93 @@
+'''
+record upstream responses to a compressed archive, and serve them again from a local stand-in server
+
+    python -m app.replay logs/capture.gz --speed 10 --port 8080
+
+then point today_url (or fixtures_url) in the settings at http://localhost:8080/<same path and query as upstream>
+'''
+from aiohttp import web
+from app.logsink import LogSink
+from bisect import bisect_right
+from urllib.parse import urlsplit
+import argparse
+import gzip
+import json
+import time
+
+
+class Recorder:
+    '''
+    appends every response to a gzip archive, one gzip member per response
+    a frame is a json header line ({"t": epoch, "url": ..., "status": ..., "size": ...}) followed by size bytes of body
+    '''
+    def __init__(self, path):
+        self.sink = LogSink(path, max_bytes=float('inf'), max_age=float('inf'))
+
+    def add(self, url, status, body):
+        if not isinstance(body, bytes):
+            return
+        header = json.dumps({'t': time.time(), 'url': url, 'status': status, 'size': len(body)}).encode()
+        self.sink.write(gzip.compress(header + b'\n' + body))
+
+    async def close(self):
+        await self.sink.close()
+
+
+def read(path):
+    '''
+    yields (t, url, status, body) for every response in an archive
+    '''
+    with gzip.open(path, 'rb') as archive:
+        while True:
+            header = archive.readline()
+            if not header:
+                return
+            header = json.loads(header)
+            yield header.get('t'), header.get('url'), header.get('status'), archive.read(header.get('size'))
+
+
+def path_qs(url):
+    parts = urlsplit(url)
+    return f'{parts.path}?{parts.query}' if parts.query else parts.path
+
+
+class ReplayServer:
+    '''
+    serves a recorded archive as if it was upstream
+    a request gets the last response recorded for the same path and query at the current replay time
+    replay time starts at the first recording when the server starts, and runs speed times faster than real time
+    '''
+    def __init__(self, frames, speed=1):
+        self.speed = speed
+        self.timeline = {}
+        for t, url, status, body in sorted(frames, key=lambda frame: frame[0]):
+            times, responses = self.timeline.setdefault(path_qs(url), ([], []))
+            times.append(t)
+            responses.append((status, body))
+        self.start = min((times[0] for times, _ in self.timeline.values()), default=0)
+        self.started = time.time()
+
+    def now(self):
+        return self.start + (time.time() - self.started) * self.speed
+
+    async def handler(self, request):
+        if request.path_qs not in self.timeline:
+            raise web.HTTPNotFound()
+        times, responses = self.timeline.get(request.path_qs)
+        status, body = responses[max(bisect_right(times, self.now()) - 1, 0)]
+        return web.Response(status=status, body=body)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_route('GET', '/{tail:.*}', self.handler)
+        return app
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='serve a recorded matchday')
+    argparser.add_argument('archive')
+    argparser.add_argument('--speed', type=float, default=1)
+    argparser.add_argument('--port', type=int, default=8080)
+    args = argparser.parse_args()
+    server = ReplayServer(read(args.archive), args.speed)
+    web.run_app(server.app(), port=args.port)
@@ -0,0 +1,53 @@
+import random
+import time
+
+
+class PollScheduler:
+    '''
+    works out how long to sleep before the next poll from the tracked matches
+    matches are MatchStates, what matters here is status, kickoff and time (see app.state)
+    * every match ended: None, time to stop polling
+    * something live: self.live seconds, self.critical around half-time and full time
+    * nothing live: sleep until self.lead seconds before the next kickoff, but never longer than self.gap
+    * kickoff passed without the match starting: self.live, self.late once it is self.patience seconds late
+    jitter is the fraction of the delay that is randomly added or removed, 0 turns it off
+    '''
+    def __init__(self, live=30, critical=15, gap=3600, lead=60, late=120, patience=1800, jitter=0.1):
+        self.live = live
+        self.critical = critical
+        self.gap = gap
+        self.lead = lead
+        self.late = late
+        self.patience = patience
+        self.jitter = jitter
+        self.windows = ((40, 65), (85, 130))  # minutes since start: end of first half to restart, full time to end of extra time
+
+    def match_delay(self, match, now):
+        if match.status == 1:
+            started = match.time or match.kickoff
+            if started is None:
+                return self.live
+            minutes = (now - started) / 60
+            if any(start <= minutes <= end for start, end in self.windows):
+                return self.critical
+            return self.live
+        kickoff = match.kickoff
+        if kickoff is None:
+            return self.live
+        until = kickoff - now - self.lead
+        if until > 0:
+            return min(until, self.gap)
+        return self.live if -until < self.patience else self.late
+
+    def next_delay(self, matches, now=None):
+        '''
+        seconds until the next poll, or None if all matches are done
+        '''
+        now = now or time.time()
+        delays = [self.match_delay(m, now) for m in matches.values() if m.status != 2]
+        if not delays:
+            return None
+        delay = min(delays)
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(delay, 1)
@@ -0,0 +1,118 @@
+import aiohttp
+import asyncio
+import json
+import time
+
+
+class SlackDispatcher:
+    '''
+    posts messages to slack webhooks, one queue and one worker per webhook
+    messages for the same channel that show up within self.window seconds are merged into one post
+    429s are retried after Retry-After, connection problems and 5xx with exponential backoff
+    in-flight posts are bounded by the semaphore given
+    if metrics (see app.metrics) is set, post times and the time from an event being seen to it being posted are kept there
+    '''
+    def __init__(self, session, sem, logger, window=1, retries=5):
+        self.session = session
+        self.sem = sem
+        self.logger = logger
+        self.window = window
+        self.retries = retries
+        self.queues = {}
+        self.workers = {}
+        self.metrics = None
+
+    def put(self, webhook, payload, seen=None):
+        '''
+        queues payload for webhook, payloads without text are dropped
+        seen is when the poll that found what the payload is about happened
+        '''
+        if not payload.get('text'):
+            return
+        if webhook not in self.queues:
+            self.queues[webhook] = asyncio.Queue()
+            self.workers[webhook] = asyncio.ensure_future(self._work(webhook, self.queues[webhook]))
+        self.queues[webhook].put_nowait((payload, seen))
+
+    @staticmethod
+    def coalesce(batch):
+        '''
+        merges the texts of all (payload, seen) going to the same channel, keeping the order they came in
+        and the earliest seen
+        '''
+        merged = {}
+        for payload, seen in batch:
+            channel = payload.get('channel')
+            if channel not in merged:
+                merged[channel] = [dict(payload), seen]
+            else:
+                merged[channel][0]['text'] += '\n' + payload.get('text')
+                if seen is not None:
+                    merged[channel][1] = min(seen, merged[channel][1] or seen)
+        return [tuple(item) for item in merged.values()]
+
+    async def _work(self, webhook, queue):
+        while True:
+            batch = [await queue.get()]
+            try:
+                await asyncio.sleep(self.window)
+                while not queue.empty():
+                    batch.append(queue.get_nowait())
+                for payload, seen in self.coalesce(batch):
+                    await self._post(webhook, payload, seen)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(e)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _post(self, webhook, payload, seen=None):
+        data = json.dumps(payload)
+        backoff = 1
+        for _ in range(self.retries):
+            retry_after = None
+            async with self.sem:
+                started = time.perf_counter()
+                try:
+                    async with self.session.post(webhook, data=data) as response:
+                        body = await response.read()
+                        status = response.status
+                        retry_after = response.headers.get('Retry-After')
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    self.logger.error(e)
+                    body, status = e, 999
+            if self.metrics is not None:
+                self.metrics.slack_post_seconds.observe(time.perf_counter() - started)
+                self.metrics.slack_posts.inc(status=status)
+            if status == 200:
+                if self.metrics is not None and seen is not None:
+                    self.metrics.event_lag.observe(time.time() - seen)
+                return True
+            if status < 500 and status not in (429, 999):
+                self.logger.error(f'slack said {status} to {payload.get("channel")}: {body}')
+                return False
+            try:
+                wait = float(retry_after)
+            except (TypeError, ValueError):
+                wait = backoff
+            backoff *= 2
+            await asyncio.sleep(wait)
+        self.logger.error(f'giving up on posting to {payload.get("channel")} after {self.retries} tries')
+        return False
+
+    async def flush(self, timeout=60):
+        '''
+        waits for everything queued to be posted, then stops the workers
+        run this before closing the session
+        '''
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self.queues.values())), timeout)
+        except asyncio.TimeoutError:
+            self.logger.error(f'slack messages still queued after {timeout} seconds, dropping them')
+        for worker in self.workers.values():
+            worker.cancel()
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+        self.queues = {}
+        self.workers = {}
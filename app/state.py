@@ -0,0 +1,52 @@
+class MatchState:
+    '''
+    everything the reporters keep track of for one match
+    status is 0 before the match, 1 while it is live and 2 once it has ended
+    kickoff and time (when we saw the match start) are epochs, or None if unknown
+    event_ids holds the ids of the api events already reported, so checking a new one is O(1)
+    '''
+    __slots__ = (
+        'match_id', 'hteam', 'ateam', 'match_type', 'status', 'kickoff', 'time',
+        'hgoals', 'agoals', 'half_time', 'hred', 'ared', 'event_ids'
+    )
+
+    def __init__(self, match_id, hteam, ateam, match_type='', status=0, kickoff=None, hgoals=0, agoals=0):
+        self.match_id = match_id
+        self.hteam = hteam
+        self.ateam = ateam
+        self.match_type = match_type
+        self.status = status
+        self.kickoff = kickoff
+        self.time = None
+        self.hgoals = hgoals
+        self.agoals = agoals
+        self.half_time = False
+        self.hred = False
+        self.ared = False
+        self.event_ids = set()
+
+    @property
+    def score(self):
+        return f'{self.hgoals} - {self.agoals}'
+
+    @property
+    def goalcount(self):
+        return self.hgoals + self.agoals
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data['event_ids'] = sorted(self.event_ids, key=str)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data.get('match_id'), data.get('hteam'), data.get('ateam'))
+        for name in cls.__slots__:
+            if name in data:
+                setattr(state, name, data.get(name))
+        state.event_ids = set(data.get('event_ids') or ())
+        return state
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__ if name != 'event_ids')
+        return f'MatchState({fields}, events={len(self.event_ids)})'
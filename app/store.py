@@ -0,0 +1,95 @@
+from app.state import MatchState
+from datetime import date
+import asyncio
+import json
+import os
+
+
+class StateStore:
+    '''
+    keeps the tracked matches on disk, so a restarted reporter carries on where the last one stopped
+    instead of announcing again and reporting goals, cards and half-times twice (or not at all)
+    the file is append-only json lines, {"day": "YYYY-MM-DD", "match": MatchState.to_dict()},
+    and only matches that changed since the last save are appended (and fsynced, off the event loop)
+    every compact_every lines, the file is rewritten with just the current state of the day and swapped in atomically
+    a half-written last line (the process dying mid-write) is skipped when loading
+    '''
+    def __init__(self, path, compact_every=200):
+        self.path = path
+        self.compact_every = compact_every
+        self.day = date.today().isoformat()
+        self.saved = {}  # match_id: dict as last written
+        self.lines = 0
+        self.lock = None
+
+    def load(self):
+        '''
+        the matches stored for today, by match_id, empty if there are none
+        '''
+        self.day = date.today().isoformat()
+        self.saved = {}
+        self.lines = 0
+        try:
+            with open(self.path, 'r') as store_file:
+                for line in store_file:
+                    self.lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get('day') == self.day:
+                        match = record.get('match')
+                        self.saved[match.get('match_id')] = match
+        except FileNotFoundError:
+            pass
+        return {match_id: MatchState.from_dict(match) for match_id, match in self.saved.items()}
+
+    async def save(self, matches):
+        '''
+        appends the matches that changed since the last save, compacts now and then
+        what changed is worked out right away, the writing (and fsync) is done in the default executor, one save at a time
+        '''
+        today = date.today().isoformat()
+        if today != self.day:
+            self.day = today
+            self.saved = {}
+        changed = []
+        for match_id, state in matches.items():
+            data = state.to_dict()
+            if self.saved.get(match_id) != data:
+                self.saved[match_id] = data
+                changed.append(data)
+        if not changed:
+            return
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        loop = asyncio.get_event_loop()
+        async with self.lock:
+            if self.lines + len(changed) > self.compact_every:
+                await loop.run_in_executor(None, self.compact, self.records(self.saved.values()))
+                self.lines = len(self.saved)
+            else:
+                await loop.run_in_executor(None, self.append, self.records(changed))
+                self.lines += len(changed)
+
+    def records(self, matches):
+        return ''.join(json.dumps({'day': self.day, 'match': data}) + '\n' for data in matches)
+
+    def append(self, records):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a') as store_file:
+            store_file.write(records)
+            store_file.flush()
+            os.fsync(store_file.fileno())
+
+    def compact(self, records):
+        '''
+        replaces the store with records (the latest state of today's matches)
+        '''
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as store_file:
+            store_file.write(records)
+            store_file.flush()
+            os.fsync(store_file.fileno())
+        os.replace(temporary, self.path)
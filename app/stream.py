@@ -0,0 +1,142 @@
+'''
+serves the events of a reporter (see app.events) to anyone who wants them, so other bots do not have to scrape upstream themselves
+
+    GET /events     server-sent events, resumes after the Last-Event-ID header (or ?last_event_id=) if given
+    GET /ws         the same events as json over a websocket, resumes after ?last_event_id= if given
+'''
+from aiohttp import web
+from collections import deque
+import asyncio
+import json
+import time
+
+
+class EventStream:
+    '''
+    the last size events, each with an increasing id, and the queues of everyone listening
+    ids are the time in milliseconds (or one more than the last id, if that is later), so they keep increasing across restarts
+    and a client resuming with an id from before a restart still gets the events after it
+    a listener that falls size events behind is dropped, and can come back with the id of the last event it got
+    '''
+    def __init__(self, size=1000):
+        self.size = size
+        self.events = deque(maxlen=size)
+        self.last_id = 0
+        self.listeners = set()
+        self.closed = False
+
+    @staticmethod
+    def stop(queue):
+        '''
+        ends the listen reading from queue, after anything it has not read yet is thrown away
+        '''
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def publish(self, event):
+        self.last_id = max(self.last_id + 1, int(time.time() * 1000))
+        event = dict(event, id=self.last_id)
+        self.events.append(event)
+        for queue in list(self.listeners):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.listeners.discard(queue)
+                self.stop(queue)
+
+    def close(self):
+        '''
+        ends every listen, so the server can be stopped without waiting for the clients (or their next heartbeat)
+        '''
+        self.closed = True
+        for queue in list(self.listeners):
+            self.listeners.discard(queue)
+            try:
+                queue.put_nowait(None)
+            except asyncio.QueueFull:
+                self.stop(queue)
+
+    def since(self, last_id):
+        return [event for event in self.events if event.get('id') > last_id]
+
+    async def listen(self, last_id=None, heartbeat=15):
+        '''
+        yields the events after last_id that are still kept, then every new one as it is published
+        None is yielded every heartbeat seconds without an event, so the connection can be kept alive
+        '''
+        if self.closed:
+            return
+        queue = asyncio.Queue(maxsize=self.size)
+        self.listeners.add(queue)
+        try:
+            if last_id is not None:
+                for event in self.since(last_id):
+                    yield event
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is None:
+                    return
+                yield event
+        finally:
+            self.listeners.discard(queue)
+
+
+def last_event_id(request):
+    try:
+        return int(request.headers.get('Last-Event-ID') or request.query.get('last_event_id'))
+    except (TypeError, ValueError):
+        return None
+
+
+async def serve(stream, port, host='0.0.0.0'):
+    '''
+    serves stream on http://host:port/events and ws://host:port/ws, returns the runner (call .cleanup() on it to stop)
+    '''
+    async def drain(ws):
+        '''
+        reads (and ignores) what the client sends, so pings, pongs and closing are handled
+        '''
+        async for _ in ws:
+            pass
+
+    async def sse(request):
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        try:
+            async for event in stream.listen(last_event_id(request)):
+                if event is None:
+                    await response.write(b': keepalive\n\n')
+                else:
+                    await response.write(f'id: {event.get("id")}\nevent: {event.get("type")}\ndata: {json.dumps(event)}\n\n'.encode())
+        except ConnectionResetError:
+            pass
+        return response
+
+    async def websocket(request):
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        reader = asyncio.ensure_future(drain(ws))
+        try:
+            async for event in stream.listen(last_event_id(request)):
+                if ws.closed:
+                    break
+                if event is not None:
+                    await ws.send_json(event)
+        except ConnectionResetError:
+            pass
+        await ws.close()  # with the reader still running, so the client's answer to the close is read
+        reader.cancel()
+        return ws
+
+    app = web.Application()
+    app.router.add_get('/events', sse)
+    app.router.add_get('/ws', websocket)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
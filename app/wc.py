@@ -1,3 +1,11 @@
+from app.changes import ChangeDetector
+from app.lanes import slack_lane, upstream_lane
+from app.logsink import shared_sink
+from app.metrics import Metrics
+from app.poller import Poller
+from app.schedule import PollScheduler
+from app.slack import SlackDispatcher
+from app.state import MatchState
 from dateutil import parser
 from datetime import datetime, timedelta
 import aiohttp
@@ -9,20 +17,39 @@ import time
 
 
 class WorldCupSlackReporter:
-    def __init__(self):
+    def __init__(self, session=None, sem=None, dispatcher=None, metrics=None, sinks=None):
+        '''
+        session and sem (the upstream lane), dispatcher, metrics and sinks (log sinks by path, see app.logsink)
+        are given when they are shared with other reporters (see app.race and app.competitions), else they are made here
+        '''
         self.today_url = 'http://worldcup.sfg.io/matches/today'
+        self.fixtures_url = 'http://worldcup.sfg.io/matches'
 
-        self.sem = asyncio.Semaphore(5)
-        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False))
+        self.changes = ChangeDetector()
+        self.recorder = None
+        self.store = None
+        self.stream = None
+        self.session, self.sem = upstream_lane() if session is None else (session, sem)
         self.logger = logging.getLogger(__file__)
         self.logger.setLevel(logging.INFO)
         logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+        self.metrics = Metrics() if metrics is None else metrics
+        self.slack_session = None  # only when the dispatcher is made here, a shared one is closed by whoever made it
+        if dispatcher is None:
+            self.slack_session, slack_sem = slack_lane()
+            dispatcher = SlackDispatcher(self.slack_session, slack_sem, self.logger)
+            dispatcher.metrics = self.metrics
+        self.dispatcher = dispatcher
         self.project_path = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+        self.request_log = shared_sink(os.path.join(self.project_path, 'logs', 'match-requests.log'), sinks)
         self.slack_instances = []
         self.slack_payload = None
-        self.update_rate = 90
+        self.scheduler = PollScheduler()
+        self.poller = Poller()
+        self.timeout = aiohttp.ClientTimeout(total=20)
 
         self.matches = {}
+        self.sleep = 0  # nothing to wait for before monitoring, the scheduler sleeps until the first kickoff
         self.event_types = {
             'goal-own': '[country]: Oh no, [player] just scored a goal on the wrong side of the field!',
             'yellow-card': '[country]: [player] just received a yellow card',
@@ -31,52 +58,91 @@ class WorldCupSlackReporter:
             'goal-penalty': '[country]: [player] gets a goal penalty'
         }
 
-    async def api_get(self, url):
-        async def _get(url):
+    async def api_get(self, url, changes_only=False):
+        '''
+        with changes_only, a conditional request is made and None is returned
+        if the response is the same as the last time (no parsing or logging is done then)
+        '''
+        async def _get(url, headers):
             try:
-                async with self.sem, self.session.get(url) as response:
-                    return await response.read(), response.status
-            except aiohttp.client_exceptions.ClientConnectorError as e:
+                async with self.sem, self.session.get(url, headers=headers, timeout=self.timeout) as response:
+                    return await response.read(), response.status, response.headers
+            except (aiohttp.client_exceptions.ClientConnectorError, asyncio.TimeoutError) as e:
                 self.logger.error(e)
-                return e, 999
-        response = await _get(url)
+                return e, 999, {}
+        headers = self.changes.conditional_headers(url, None) if changes_only else None
+        started = time.perf_counter()
+        response = await _get(url, headers)
+        self.metrics.fetch_seconds.observe(time.perf_counter() - started)
+        self.metrics.fetch_responses.inc(status=response[1])
+        if self.recorder is not None:
+            self.recorder.add(url, response[1], response[0])
+        if changes_only and response[1] == 304:
+            return
         if response[1] != 200:
             raise ConnectionError(f'did not get a 200 response: {response[0]}')
-        with open(os.path.join(self.project_path, 'logs', 'match-requests.log'), 'a+') as logfile:
-            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            data = json.dumps(json.loads(response[0]))
-            logfile.write(f'{now}: {data}\n')
-        return json.loads(response[0])
+        if changes_only:
+            self.changes.remember(url, response[2])
+            started = time.perf_counter()
+            data = self.changes.json(url, response[0])
+            if data is None:
+                return
+        else:
+            started = time.perf_counter()
+            data = json.loads(response[0])
+        self.metrics.parse_seconds.observe(time.perf_counter() - started)
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.request_log.write(f'{now}: '.encode() + response[0] + b'\n')
+        return data
+
+    def apply(self, config):
+        '''
+        takes its settings from config (see app.config)
+        '''
+        self.slack_instances = list(config.slack_instances)
+        self.slack_payload = config.slack_payload
+        self.scheduler.jitter = config.poll_jitter
+
+    async def get_fixtures(self):
+        '''
+        kickoffs (epochs) of every match in the tournament, for the daemon's calendar (see app.daemon)
+        '''
+        try:
+            matches = await self.api_get(self.fixtures_url)
+        except ConnectionError as e:
+            self.logger.error(e)
+            return
+        return [parser.parse(match.get('datetime')).timestamp() for match in matches]
 
     async def get_todays_matches(self):
         try:
             matches = await self.api_get(self.today_url)
         except ConnectionError as e:
             self.logger.error(e)
+            return
         message = 'Today\'s matches:\n'
         for match in matches:
             hteam = match.get('home_team').get('country')
             ateam = match.get('away_team').get('country')
             venue = match.get('location') + ', ' + match.get('venue')
-            start_time = (parser.parse(match.get('datetime')) + timedelta(hours=2)).strftime('%H:%M')
+            match_datetime = parser.parse(match.get('datetime'))
+            start_time = (match_datetime + timedelta(hours=2)).strftime('%H:%M')
             match_id = match.get('home_team').get('code') + match.get('away_team').get('code')
             if match_id not in self.matches:
-                self.matches[match_id] = {
-                    'score': 0,
-                    'goals': {'h': 0, 'a': 0},
-                    'event_ids': [],
-                    'status': 0,
-                    'time': None,
-                    'half-time': False
-                }
+                self.matches[match_id] = MatchState(match_id, hteam, ateam, kickoff=match_datetime.timestamp())
             message += f'{start_time}: {hteam} vs {ateam} @ {venue}\n'
-        asyncio.ensure_future(self._slack_output(message.rstrip()))
+        await self._slack_output(message.rstrip())
 
     async def get_current_matches(self):
         try:
-            matches = await self.api_get(self.today_url)
+            matches = await self.api_get(self.today_url, changes_only=True)
         except ConnectionError as e:
             self.logger.error(e)
+            return
+        if matches is None:  # nothing changed upstream, but a match stuck in play still has to end some time
+            await self.check_timeouts(time.time())
+            return
+        seen = time.time()
         for match in matches:
             message = ''
             hteam = match.get('home_team').get('country')
@@ -85,63 +151,90 @@ class WorldCupSlackReporter:
             ateam = match.get('away_team').get('country')
             ateamgoals = match.get('away_team').get('goals')
 
-            score = hteamgoals + ateamgoals
             match_id = match.get('home_team').get('code') + match.get('away_team').get('code')
-            if hteamgoals < self.matches.get(match_id).get('goals').get('h'):
-                hteamgoals = self.matches.get(match_id).get('goals').get('h')
-            if ateamgoals < self.matches.get(match_id).get('goals').get('a'):
-                ateamgoals = self.matches.get(match_id).get('goals').get('a')
+            state = self.matches.get(match_id)
+            if state is None:
+                continue
+            hteamgoals = max(hteamgoals or 0, state.hgoals)
+            ateamgoals = max(ateamgoals or 0, state.agoals)
+            score = hteamgoals + ateamgoals
 
-            if match.get('status') == 'in progress' and self.matches.get(match_id).get('status') == 0:
+            if match.get('status') == 'in progress' and state.status == 0:
                 message += f'{hteam} vs {ateam} just started!\n'
-                self.matches[match_id]['status'] = 1
-                self.matches[match_id]['time'] = time.time()
+                self.metrics.events.inc(type='start')
+                state.status = 1
+                state.time = time.time()
 
-            if self.matches.get(match_id).get('status') == 2:
+            if state.status == 2:
                 continue
-            for item in match.get('home_team_events'):
-                item['code'] = match.get('home_team').get('code')
-            for item in match.get('away_team_events'):
-                item['code'] = match.get('away_team').get('code')
-            events = match.get('home_team_events') + match.get('away_team_events')
+            events = []
+            for side in ('home_team', 'away_team'):
+                for item in match.get(f'{side}_events'):
+                    if item.get('id') not in state.event_ids:
+                        item['code'] = match.get(side).get('code')
+                        item['side'] = side
+                        events.append(item)
             for eid in sorted(events, key=lambda x: x.get('id')):
-                if eid.get('id') in self.matches.get(match_id).get('event_ids'):
-                    continue
-                self.matches[match_id]['event_ids'].append(eid.get('id'))
+                state.event_ids.add(eid.get('id'))
+                if eid.get('type_of_event') == 'red-card':  # so it is an event for app.events (the stream, the journal and app.race)
+                    setattr(state, 'hred' if eid.get('side') == 'home_team' else 'ared', True)
                 event_text = self.event_types.get(eid.get('type_of_event'), '').replace('[player]', eid.get('player')).replace('[country]', eid.get('code'))
                 if event_text == '':
                     continue
                 message += f'{event_text}\n'
-            if match.get('time') == 'half-time' and not self.matches.get(match_id).get('half-time'):
-                self.matches[match_id]['half-time'] = True
+                self.metrics.events.inc(type=eid.get('type_of_event'))
+            if match.get('time') == 'half-time' and not state.half_time:
+                state.half_time = True
                 message += f'Half-time: {hteam} {hteamgoals} vs {ateamgoals} {ateam}\n'
-            if score > self.matches.get(match_id).get('score'):
+                self.metrics.events.inc(type='half_time')
+            if score > state.goalcount:
                 message += f'Score update: {hteam} {hteamgoals} - {ateamgoals} {ateam}\n'
-                self.matches[match_id]['score'] = score
+                self.metrics.events.inc(type='score_update')
+                state.hgoals, state.agoals = hteamgoals, ateamgoals
             if match.get('status') == 'completed' or match.get('winner') or match.get('time') == 'full-time':
                 message += f'Match ended! Final score:\n{hteam} {hteamgoals} - {ateamgoals} {ateam}\n'
-                self.matches[match_id]['status'] = 2
-            if self.matches.get(match_id).get('status') == 1:
-                timediff = time.time() - self.matches.get(match_id).get('time')
+                self.metrics.events.inc(type='end')
+                state.status = 2
+            if state.status == 1:
+                timediff = time.time() - state.time
                 if timediff > 9000:
                     message += f'Match (probably) ended (2h since start)! Final score:\n{hteam} {hteamgoals} - {ateamgoals} {ateam}\n'
-                    self.matches[match_id]['status'] = 2
-            asyncio.ensure_future(self._slack_output(message.rstrip()))
+                    self.metrics.events.inc(type='end')
+                    state.status = 2
+            await self._slack_output(message.rstrip(), seen)
+
+    async def check_timeouts(self, seen):
+        '''
+        ends the matches still in play 2h after they started, for polls that had nothing new to look at
+        '''
+        for state in self.matches.values():
+            if state.status == 1 and seen - state.time > 9000:
+                self.metrics.events.inc(type='end')
+                state.status = 2
+                await self._slack_output(
+                    f'Match (probably) ended (2h since start)! Final score:\n{state.hteam} {state.hgoals} - {state.agoals} {state.ateam}', seen
+                )
 
     async def monitor(self):
-        asyncio.ensure_future(self.get_current_matches())
-        await asyncio.sleep(self.update_rate)
-        asyncio.ensure_future(self.monitor())
+        '''
+        polls until all of today's matches are done, see Poller
+        '''
+        await self.poller.run(self)
 
-    async def _slack_output(self, message):
-        async def _send(url, output):
-            try:
-                async with self.sem, self.session.post(url, data=output) as response:
-                    return await response.read(), response.status
-            except aiohttp.client_exceptions.ClientConnectorError as e:
-                self.logger.error(e)
+    async def _slack_output(self, message, seen=None):
+        if not message:
+            return
         for si in self.slack_instances:
-            output = dict(self.slack_payload)
+            output = dict(si.get('slack_payload') or self.slack_payload)
             output['text'] = message
             output['channel'] = si.get('channel')
-            asyncio.ensure_future(_send(si.get('webhook'), json.dumps(output)))
+            self.dispatcher.put(si.get('webhook'), output, seen)
+
+    async def close(self):
+        await self.dispatcher.flush()
+        await self.session.close()
+        if self.slack_session is not None:
+            await self.slack_session.close()
+        await self.request_log.close()
+        if self.recorder is not None:
+            await self.recorder.close()
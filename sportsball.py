@@ -1,37 +1,134 @@
-from app import google as sportsball  # other choices are fd and wc, just replace google
+from app.config import ConfigError, load
+import argparse
 import asyncio
-import json
+import importlib
 import os
 import sys
 
 
-async def main(file):
+def reporter_class(provider):
+    '''
+    the reporter of provider (google, fd or wc), imported only now so that only its own dependencies are loaded
+    '''
+    return importlib.import_module(f'app.{provider}').WorldCupSlackReporter
+
+
+def flag(name):
+    '''
+    whether the environment variable name switches something on (1, true, yes or on)
+    '''
+    return os.environ.get(name, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def build(config):
+    '''
+    the reporter (or the reporters, raced or one per competition) that config asks for
+    '''
+    if config.providers:  # more than one provider, the first one to see an event posts it
+        from app.race import Race
+        race = Race([reporter_class(provider) for provider in config.providers], config.team_aliases)
+        for source in race.sources:
+            source.apply(config)
+        return race
+    if config.competitions:  # google queries, or football-data.org competition ids for fd
+        from app.competitions import Competitions
+        WCS = Competitions(importlib.import_module(f'app.{config.provider}'), config.competitions, config.max_requests)
+        for reporter in WCS.reporters:
+            reporter.apply(config)
+        return WCS
+    WCS = reporter_class(config.provider)()
+    WCS.apply(config)
+    for url in ('today_url', 'fixtures_url'):  # for pointing the reporter at a replay server, see app/replay.py
+        if getattr(config, url):
+            setattr(WCS, url, getattr(config, url))
+    if config.capture:
+        from app.replay import Recorder
+        WCS.recorder = Recorder(config.capture)
+    return WCS
+
+
+async def main(config, profile=False, daemon=False, recap=False):
     '''
     just starts up the class run it until all of todays matches are done
     feel free to use the class in other ways if preferred
-    you can specify another settings file than settings.json as an argument, for testing purposes
+    config comes from the settings files, see app/config.py
+    with profile, every poll is profiled and timed into logs/
+    with daemon, it keeps running for the whole tournament instead (see app.daemon)
+    with recap, it only posts what has happened today (from the journal, see app/journal.py) and exits
     '''
-    WCS = sportsball.WorldCupSlackReporter()
-    if not file:
-        with open(os.path.join(WCS.project_path, 'settings', 'settings.json'), 'r') as settings_file:
-            settings = json.load(settings_file)
+    WCS = build(config)
+    journal = None
+    if config.journal:
+        from app.journal import Journal
+        journal = Journal(config.journal)
+        if recap:
+            await WCS._slack_output(await journal.digest())
+            await WCS.close()
+            await journal.close()
+            return
+    if config.state:  # picks up today's matches from there after a restart, see app/store.py
+        from app.store import StateStore
+        WCS.store = StateStore(config.state)
+        WCS.matches = WCS.store.load()
+    if profile:
+        from app.profiling import PollProfiler
+        profiler = PollProfiler(os.path.join(WCS.project_path, 'logs'))
+        for reporter in getattr(WCS, 'sources', None) or getattr(WCS, 'reporters', None) or [WCS]:  # every provider or competition polls on its own
+            reporter.poller.profiler = profiler
+    metrics_server = None
+    if config.metrics_port:
+        from app.metrics import serve
+        metrics_server = await serve(WCS, config.metrics_port)
+    stream_server = None
+    if config.stream_port:  # events for other bots, see app/stream.py
+        from app.stream import EventStream, serve as serve_stream
+        stream = EventStream()
+        stream_server = await serve_stream(stream, config.stream_port)
+        WCS.stream = stream
+    if journal is not None:  # every event is written to the journal, then passed on to the stream if there is one
+        journal.stream = WCS.stream
+        WCS.stream = journal
+    if daemon:
+        from app.daemon import Daemon
+        await Daemon(config.announce_at, journal=journal, digest=config.digest).run(WCS)
     else:
-        with open(file, 'r') as settings_file:
-            settings = json.load(settings_file)
-    WCS.slack_instances = settings.get('slack_instances')
-    WCS.slack_payload = settings.get('slack_payload')
-    # WCS.headers = {'X-Auth-Token': settings.get('football-data-token')}  # uncomment if using fd.py
-    WCS.hours_to_add = settings.get('hours_to_add') if settings.get('hours_to_add') else 0  # only for google.py
-    await WCS.get_todays_matches()
-    await asyncio.sleep(WCS.sleep)
-    await WCS.monitor()
-    await WCS.session.close()
+        if not WCS.matches:
+            await WCS.get_todays_matches()
+            if journal is not None:  # so that a restart does not post what was already posted
+                await journal.replay(WCS.matches)
+            if WCS.store is not None:
+                await WCS.store.save(WCS.matches)
+            await asyncio.sleep(WCS.sleep)
+        await WCS.monitor()
+        if config.digest and journal is not None:
+            await WCS._slack_output(await journal.digest())
+    await WCS.close()
+    if journal is not None:
+        await journal.close()
+    if profile:
+        await profiler.close()
+    if metrics_server is not None:
+        await metrics_server.cleanup()
+    if stream_server is not None:
+        stream.close()
+        await stream_server.cleanup()
 
 if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='reports football matches to slack')
+    argparser.add_argument('settings', nargs='*', help='settings files (or directories of them) to use instead of settings/settings.json')
+    argparser.add_argument('--provider', choices=('google', 'fd', 'wc'), help='where the matches come from, instead of provider in the settings (google by default)')
+    argparser.add_argument('--profile', action='store_true', default=flag('SPORTSBALL_PROFILE'),
+                           help='profile every poll, see app/profiling.py (or set SPORTSBALL_PROFILE=1)')
+    argparser.add_argument('--daemon', action='store_true', default=flag('SPORTSBALL_DAEMON'),
+                           help='keep running for the whole tournament instead of exiting after today (or set SPORTSBALL_DAEMON=1)')
+    argparser.add_argument('--recap', action='store_true', help='post a recap of today from the journal and exit')
+    args = argparser.parse_args()
     try:
-        file = sys.argv[1]
-    except Exception:
-        file = None
+        config = load(args.settings or [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings', 'settings.json')], args.provider)
+    except (OSError, ConfigError) as e:
+        sys.exit(f'bad settings: {e}')
+    if args.recap and not config.journal:
+        argparser.error('--recap needs "journal" in the settings')
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(main(file))
+    loop.run_until_complete(main(config, args.profile, args.daemon, args.recap))
     loop.close()
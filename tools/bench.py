@@ -0,0 +1,259 @@
+'''
+benchmarks the parse -> diff -> notify pipeline of all three reporters against generated pages and payloads
+upstream and the slack webhooks are local aiohttp servers, so nothing leaves the machine
+
+    python tools/bench.py                               # matches and slack instances scaled one at a time
+    python tools/bench.py --grid                        # every combination
+    python tools/bench.py --parse-workers process       # google pages parsed in a process pool
+    python tools/bench.py --output logs/bench.json
+    python tools/bench.py --compare logs/bench.json     # ratios against an earlier run
+
+prints one json object per line: reporter, matches, instances, median ms per stage
+(fetch, parse, diff, render, post) and memory allocated during one full poll
+the reporters' logs are written to a temporary directory
+'''
+from aiohttp import web
+from datetime import datetime
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from app import fd, google, wc  # noqa: E402
+from app.cards import MATCH_CLASS  # noqa: E402
+from app.changes import ChangeDetector  # noqa: E402
+from app.logsink import LogSink  # noqa: E402
+
+PORT = 8931
+LOGS = tempfile.mkdtemp(prefix='sportsball-bench-')
+
+
+def google_team(name, goals):
+    return (f'<div><i></i><div><span>{goals}</span><div><div>{name}<span></span><div><span style="display:none"></span></div></div></div></div>'
+            '<div><span style="display:none"></span></div></div>')
+
+
+def google_card(i, goals):
+    return (f'<div class="{MATCH_CLASS}"><div><i></i>'
+            '<div><div><div><i></i><i></i><span>Group A</span></div></div></div>'
+            f'<div><i></i><i></i><div><div>Live {10 + goals}\'</div></div></div><i></i>'
+            f'{google_team(f"Home{i}", goals)}{google_team(f"Away{i}", 0)}</div></div>')
+
+
+def google_page(matches, goals):
+    filler = '<div class="ad"><script>var x = 1;</script>' + 'lorem ipsum ' * 2000 + '</div>'
+    return f'<html><head></head><body>{filler}{"".join(google_card(i, goals) for i in range(matches))}{filler}</body></html>'.encode()
+
+
+def wc_payload(matches, goals):
+    events = [{'id': 1, 'type_of_event': 'goal', 'player': 'Someone'}] if goals else []
+    return json.dumps([{
+        'home_team': {'country': f'Home {i}', 'code': f'H{i:03d}', 'goals': goals},
+        'away_team': {'country': f'Away {i}', 'code': f'A{i:03d}', 'goals': 0},
+        'home_team_events': [dict(e, id=i * 10 + e['id']) for e in events], 'away_team_events': [],
+        'location': 'Moscow', 'venue': 'Luzhniki Stadium', 'datetime': '2018-06-14T15:00:00Z',
+        'status': 'in progress', 'time': f'{10 + goals}\'', 'winner': None
+    } for i in range(matches)]).encode()
+
+
+def fd_payload(matches, goals):
+    date = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+    return json.dumps({'fixtures': [{
+        'date': date, 'status': 'IN_PLAY', 'matchday': 1,
+        'homeTeamName': f'Home {i}', 'awayTeamName': f'Away {i}',
+        'result': {'goalsHomeTeam': goals, 'goalsAwayTeam': 0}
+    } for i in range(matches)]}).encode()
+
+
+PAYLOADS = {'google': google_page, 'wc': wc_payload, 'fd': fd_payload}
+MODULES = {'google': google, 'wc': wc, 'fd': fd}
+
+
+class Upstream:
+    '''
+    the fake upstream (serving self.body) and the fake slack webhooks (counting posts)
+    '''
+    def __init__(self):
+        self.body = b''
+        self.posts = 0
+
+    async def get(self, request):
+        return web.Response(body=self.body)
+
+    async def post(self, request):
+        await request.read()
+        self.posts += 1
+        return web.Response(text='ok')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/upstream', self.get)
+        app.router.add_post('/hook/{n}', self.post)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, '127.0.0.1', PORT).start()
+
+
+def reporter(name, instances, workers=None):
+    r = MODULES[name].WorldCupSlackReporter()
+    r.output = False
+    r.today_url = r.fixtures_url = f'http://127.0.0.1:{PORT}/upstream'
+    r.slack_payload = {'username': 'Sportsball', 'icon_emoji': ':soccer:'}
+    r.slack_instances = [{
+        'channel': f'#bench{n}', 'webhook': f'http://127.0.0.1:{PORT}/hook/{n}',
+        'participants': {'Home1': 'Someone', 'Away2': 'Someone else', 'Home3': 'A third person'}
+    } for n in range(instances)]
+    r.dispatcher.window = 0
+    r.project_path = LOGS  # the payloads logged while benchmarking do not belong in the real logs
+    for sink in ('banana_log', 'request_log'):
+        if hasattr(r, sink):
+            setattr(r, sink, LogSink(os.path.join(LOGS, os.path.basename(getattr(r, sink).path))))
+    if workers is not None and name == 'google':
+        r.use_workers(workers)
+    return r
+
+
+def timed(timings, stage, started):
+    timings.setdefault(stage, []).append((time.perf_counter() - started) * 1000)
+
+
+async def one_run(name, upstream, matches, instances, timings, workers=None):
+    '''
+    fetch and parse are the reporter's own url_get/api_get (changes_only, with the strainer or the parse workers if set),
+    timed by its metrics (see app.metrics), parse includes extracting the matches
+    diff, render and post are timed here, with the same payload handed to get_current_matches again
+    '''
+    base = PAYLOADS[name](matches, 0)
+    goal = PAYLOADS[name](matches, 1)
+    r = reporter(name, instances, workers)
+    messages = []
+
+    async def collect(message, seen=None):
+        messages.append((message, seen))
+    post = r._slack_output
+    r._slack_output = collect
+
+    method = 'url_get' if name == 'google' else 'api_get'
+    get = getattr(r, method)
+    upstream.body = base
+    found = {'data': await get(r.today_url, changes_only=True)}
+    r.changes.commit()
+
+    async def fake_get(url, changes_only=False):
+        return found['data']
+    setattr(r, method, fake_get)
+    await r.get_todays_matches()
+    if name != 'google':
+        await r.get_current_matches()
+
+    upstream.body = goal
+    fetched, parsed = r.metrics.fetch_seconds.sum(), r.metrics.parse_seconds.sum()
+    found['data'] = await get(r.today_url, changes_only=True)
+    timings.setdefault('fetch', []).append((r.metrics.fetch_seconds.sum() - fetched) * 1000)
+    timings.setdefault('parse', []).append((r.metrics.parse_seconds.sum() - parsed) * 1000)
+
+    messages.clear()
+    started = time.perf_counter()
+    await r.get_current_matches()
+    timed(timings, 'diff', started)
+
+    put = r.dispatcher.put
+    queued = []
+    r.dispatcher.put = lambda webhook, payload, seen=None: queued.append((webhook, payload, seen))
+    started = time.perf_counter()
+    for message, seen in messages:
+        await post(message, seen)
+    timed(timings, 'render', started)
+
+    r.dispatcher.put = put
+    started = time.perf_counter()
+    for webhook, payload, seen in queued:
+        put(webhook, payload, seen)
+    await r.dispatcher.flush()
+    timed(timings, 'post', started)
+    await r.close()
+
+
+async def allocations(name, upstream, matches, instances, workers=None):
+    '''
+    memory allocated during one full poll: fetch, parse, diff, render and post
+    '''
+    r = reporter(name, instances, workers)
+    upstream.body = PAYLOADS[name](matches, 0)
+    await r.get_todays_matches()
+    await r.get_current_matches()
+    upstream.body = PAYLOADS[name](matches, 1)
+    r.changes = ChangeDetector()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    await r.get_current_matches()
+    await r.dispatcher.flush()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await r.close()
+    return round((peak - before) / 1024, 1), round((current - before) / 1024, 1)
+
+
+async def bench(name, upstream, matches, instances, repeat, workers=None):
+    timings = {}
+    for _ in range(repeat):
+        await one_run(name, upstream, matches, instances, timings, workers)
+    peak, net = await allocations(name, upstream, matches, instances, workers)
+    result = {'reporter': name, 'matches': matches, 'instances': instances}
+    result.update({f'{stage}_ms': round(statistics.median(values), 3) for stage, values in timings.items()})
+    result.update({'alloc_peak_kb': peak, 'alloc_net_kb': net})
+    return result
+
+
+def cases(grid):
+    matches = (1, 10, 100, 300)
+    instances = (1, 10, 100, 300)
+    if grid:
+        return [(m, i) for m in matches for i in instances]
+    return [(m, 1) for m in matches] + [(10, i) for i in instances if i != 1]
+
+
+def compare(results, path):
+    with open(path, 'r') as baseline_file:
+        baseline = {(b['reporter'], b['matches'], b['instances']): b for b in map(json.loads, baseline_file)}
+    for result in results:
+        old = baseline.get((result['reporter'], result['matches'], result['instances']))
+        if old is None:
+            continue
+        ratios = {k: round(v / old[k], 2) if old.get(k) else None for k, v in result.items() if k.endswith(('_ms', '_kb'))}
+        print(json.dumps(dict(reporter=result['reporter'], matches=result['matches'], instances=result['instances'], vs_baseline=ratios)))
+
+
+async def main(args):
+    upstream = Upstream()
+    await upstream.start()
+    results = []
+    for name in args.reporters:
+        for matches, instances in cases(args.grid):
+            result = await bench(name, upstream, matches, instances, args.repeat, args.parse_workers)
+            results.append(result)
+            print(json.dumps(result), flush=True)
+    await upstream.runner.cleanup()
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(''.join(json.dumps(result) + '\n' for result in results))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description='benchmark the parse -> diff -> notify pipeline')
+    argparser.add_argument('--reporters', nargs='+', default=['google', 'wc', 'fd'], choices=['google', 'wc', 'fd'])
+    argparser.add_argument('--repeat', type=int, default=5)
+    argparser.add_argument('--grid', action='store_true')
+    argparser.add_argument('--parse-workers', choices=['process', 'thread'], help='parse the google pages in a worker pool, see use_workers in google.py')
+    argparser.add_argument('--output')
+    argparser.add_argument('--compare')
+    asyncio.run(main(argparser.parse_args()))